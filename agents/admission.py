@@ -0,0 +1,237 @@
+"""Admission control for incoming NPC chat messages.
+
+Every admitted turn costs several LLM calls, so messages pass through an
+admission layer before reaching the NPC:
+    - A token bucket per sender limits how many turns each sender can start
+    - A global bounded queue holds at most one pending turn per sender and is
+      served round-robin, so a chatty sender cannot starve the others
+    - Each sender has at most one turn running at a time, so their replies
+      arrive in order and their turns never update the NPC concurrently
+    - Messages that arrive while the sender's turn is queued or running are
+      coalesced into their next turn instead of starting another one, up to a
+      cap on the messages and characters one turn may hold
+    - When the bucket is empty, the queue is full or the pending turn is at
+      its cap, an in-character busy reply is sent straight away without
+      calling the LLM
+
+Key Components:
+    TokenBucket: Refilling per-sender turn allowance
+    AdmissionController: Queues, coalesces and schedules turns across workers
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Sustained turns per second and burst size allowed for each sender
+SENDER_TURNS_PER_SECOND = 0.2
+SENDER_BURST = 3
+# Turns waiting for a worker, across all senders
+MAX_QUEUED_TURNS = 16
+# Turns handled at once, i.e. concurrent LLM pipelines
+MAX_CONCURRENT_TURNS = 2
+# Messages and characters a single turn may hold, longer messages are truncated
+MAX_TURN_MESSAGES = 5
+MAX_TURN_CHARACTERS = 2000
+
+# Admission outcomes returned by AdmissionController.submit
+QUEUED = "queued"
+COALESCED = "coalesced"
+RATE_LIMITED = "rate_limited"
+QUEUE_FULL = "queue_full"
+
+
+class TokenBucket:
+    """Token bucket that refills at a fixed rate up to its capacity
+
+    Args:
+        rate: Tokens added per second
+        capacity: Maximum tokens held, i.e. the burst size
+        clock: Monotonic clock returning seconds
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def try_acquire(self) -> bool:
+        """Take one token if available.
+
+        Returns:
+            True if a token was taken, False if the bucket is empty.
+        """
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+@dataclass
+class _PendingTurn:
+    """Messages from one sender waiting to be handled as a single turn"""
+
+    texts: list[str]
+    reply: Callable[[str], Awaitable[None]]
+    characters: int = 0
+
+
+class AdmissionController:
+    """Admits, coalesces and fairly schedules chat turns
+
+    Args:
+        handler: Coroutine function taking (sender, text) and returning the reply
+        busy_reply: Function taking an admission outcome and returning the
+            in-character reply sent when a message is turned away
+        rate: Sustained turns per second per sender
+        burst: Turns a sender may start back to back
+        max_queued: Maximum pending turns across all senders
+        workers: Maximum turns handled concurrently
+        max_turn_messages: Maximum messages coalesced into one turn
+        max_turn_characters: Maximum characters of one turn's messages
+        clock: Monotonic clock returning seconds
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str, str], Awaitable[str]],
+        busy_reply: Callable[[str], str],
+        rate: float = SENDER_TURNS_PER_SECOND,
+        burst: int = SENDER_BURST,
+        max_queued: int = MAX_QUEUED_TURNS,
+        workers: int = MAX_CONCURRENT_TURNS,
+        max_turn_messages: int = MAX_TURN_MESSAGES,
+        max_turn_characters: int = MAX_TURN_CHARACTERS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.handler = handler
+        self.busy_reply = busy_reply
+        self.rate = rate
+        self.burst = burst
+        self.max_queued = max_queued
+        self.num_workers = workers
+        self.max_turn_messages = max_turn_messages
+        self.max_turn_characters = max_turn_characters
+        self.clock = clock
+        self.buckets: dict[str, TokenBucket] = {}
+        self.pending: dict[str, _PendingTurn] = {}
+        # Senders whose turn is being handled by a worker
+        self.running: set[str] = set()
+        # Senders with a pending turn and none running, in the order they are served
+        self.ready: deque[str] = deque()
+        self.stats = dict.fromkeys((QUEUED, COALESCED, RATE_LIMITED, QUEUE_FULL), 0)
+        self._wakeup = None
+        self._workers = []
+
+    def _start_workers(self):
+        """Start the worker tasks on the running event loop."""
+        self._wakeup = asyncio.Condition()
+        self._workers = [
+            asyncio.create_task(self._work(), name=f"npc-turn-worker-{index}")
+            for index in range(self.num_workers)
+        ]
+
+    async def submit(
+        self,
+        sender: str,
+        text: str,
+        reply: Callable[[str], Awaitable[None]],
+    ) -> str:
+        """Admit a message without waiting for its turn to be handled.
+
+        Args:
+            sender: Address of the message sender
+            text: The message text
+            reply: Coroutine function that sends a reply text to the sender
+
+        Returns:
+            The admission outcome: QUEUED, COALESCED, RATE_LIMITED or QUEUE_FULL.
+            Messages that would take the sender's pending turn over its message
+            or character cap are RATE_LIMITED.
+        """
+        if not self._workers:
+            self._start_workers()
+        text = text[: self.max_turn_characters]
+        pending = self.pending.get(sender)
+        if pending is not None:
+            if (
+                len(pending.texts) >= self.max_turn_messages
+                or pending.characters + len(text) > self.max_turn_characters
+            ):
+                outcome = RATE_LIMITED
+            else:
+                pending.texts.append(text)
+                pending.characters += len(text)
+                pending.reply = reply
+                outcome = COALESCED
+        else:
+            bucket = self.buckets.get(sender)
+            if bucket is None:
+                bucket = self.buckets[sender] = TokenBucket(
+                    self.rate, self.burst, self.clock
+                )
+            if len(self.pending) >= self.max_queued:
+                outcome = QUEUE_FULL
+            elif not bucket.try_acquire():
+                outcome = RATE_LIMITED
+            else:
+                self.pending[sender] = _PendingTurn([text], reply, len(text))
+                # A running sender is made ready again when their turn finishes
+                if sender not in self.running:
+                    await self._make_ready(sender)
+                outcome = QUEUED
+        self.stats[outcome] += 1
+        if outcome in (RATE_LIMITED, QUEUE_FULL):
+            logger.info(f"Turned away message from {sender}: {outcome}")
+            await reply(self.busy_reply(outcome))
+        return outcome
+
+    async def _make_ready(self, sender: str):
+        """Queue a sender's pending turn for the workers."""
+        async with self._wakeup:
+            self.ready.append(sender)
+            self._wakeup.notify()
+
+    async def _work(self):
+        """Handle pending turns one sender at a time, in round-robin order."""
+        while True:
+            async with self._wakeup:
+                await self._wakeup.wait_for(lambda: self.ready)
+                sender = self.ready.popleft()
+            turn = self.pending.pop(sender)
+            self.running.add(sender)
+            try:
+                response = await self.handler(sender, "\n".join(turn.texts))
+                await turn.reply(response)
+            except Exception as e:
+                logger.error(f"Error handling turn from {sender}: {e}")
+            finally:
+                self.running.discard(sender)
+                # Messages that arrived during the turn form the sender's next one
+                if sender in self.pending:
+                    await self._make_ready(sender)
+
+    async def close(self):
+        """Cancel the worker tasks, dropping any pending turns."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self.pending.clear()
+        self.running.clear()
+        self.ready.clear()
@@ -0,0 +1,330 @@
+"""Deterministic D&D combat rules engine.
+
+Resolves attacks locally so that the LLM only narrates outcomes that have
+already been decided. A character template's ability scores, level, weapon and
+AC are parsed once into a CombatProfile (attack bonus, damage dice and
+modifier), and all rolls come from a seedable NumPy generator so that fights
+can be replayed. The same rules run in vectorised batches to simulate many
+encounters at once for balancing.
+
+Key Components:
+    CombatProfile: Precomputed attack and defence numbers for one character
+    CombatEngine: Seedable dice roller for single attacks and batched simulations
+    parse_player_attack: Read declared attack and damage rolls from a message
+"""
+
+import re
+from dataclasses import dataclass
+
+import numpy as np
+
+from agents.template_store import ATTRIBUTE_NAMES, parse_attributes
+
+# Weapon name: (number of damage dice, die size, ability used)
+# "finesse" weapons use the better of Str and Dex, "dex" weapons are ranged
+WEAPONS = {
+    "unarmed strike": (0, 0, "str"),
+    "fist": (0, 0, "str"),
+    "bite": (1, 6, "str"),
+    "club": (1, 4, "str"),
+    "dagger": (1, 4, "finesse"),
+    "dart": (1, 4, "finesse"),
+    "whip": (1, 4, "finesse"),
+    "sickle": (1, 4, "str"),
+    "light hammer": (1, 4, "str"),
+    "sling": (1, 4, "dex"),
+    "quarterstaff": (1, 6, "str"),
+    "handaxe": (1, 6, "str"),
+    "javelin": (1, 6, "str"),
+    "mace": (1, 6, "str"),
+    "spear": (1, 6, "str"),
+    "trident": (1, 6, "str"),
+    "shortsword": (1, 6, "finesse"),
+    "scimitar": (1, 6, "finesse"),
+    "shortbow": (1, 6, "dex"),
+    "crossbow, hand": (1, 6, "dex"),
+    "greatclub": (1, 8, "str"),
+    "longsword": (1, 8, "str"),
+    "battleaxe": (1, 8, "str"),
+    "warhammer": (1, 8, "str"),
+    "war pick": (1, 8, "str"),
+    "morningstar": (1, 8, "str"),
+    "flail": (1, 8, "str"),
+    "rapier": (1, 8, "finesse"),
+    "longbow": (1, 8, "dex"),
+    "crossbow, light": (1, 8, "dex"),
+    "glaive": (1, 10, "str"),
+    "halberd": (1, 10, "str"),
+    "pike": (1, 10, "str"),
+    "crossbow, heavy": (1, 10, "dex"),
+    "pistol": (1, 10, "dex"),
+    "musket": (1, 12, "dex"),
+    "greataxe": (1, 12, "str"),
+    "lance": (1, 12, "str"),
+    "greatsword": (2, 6, "str"),
+    "maul": (2, 6, "str"),
+}
+DEFAULT_WEAPON = (1, 6, "finesse")
+DEFAULT_AC = 10
+DEFAULT_HP = 20
+MAX_SIMULATED_ROUNDS = 100
+
+# The damage number must not be part of dice notation such as "2d6" or "1d8+3",
+# those messages are left to the LLM
+_PLAYER_ATTACK_PATTERN = re.compile(
+    r"roll(?:ed|ing|s)?\s+(?:an?\s+)?(\d+)\s+to\s+hit.*?"
+    r"(?<![\dd+])(\d+)\s*(?:points?\s+of\s+)?damage",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def ability_modifier(score: int) -> int:
+    """Return the D&D ability modifier for an ability score."""
+    return (score - 10) // 2
+
+
+def proficiency_bonus(level: int) -> int:
+    """Return the D&D proficiency bonus for a character level."""
+    return 2 + (max(1, level) - 1) // 4
+
+
+def parse_weapon(weapon: str) -> tuple[int, int, str, int]:
+    """Look up a weapon's damage dice, attack ability and magic bonus.
+
+    Args:
+        weapon: Weapon name from a template, e.g. "Crossbow, light" or "+1 Rapier"
+
+    Returns:
+        A tuple of (dice count, die size, ability, magic bonus). Unknown weapons
+        use DEFAULT_WEAPON.
+    """
+    name = weapon.lower()
+    magic = re.search(r"\+(\d)", name)
+    for known in sorted(WEAPONS, key=len, reverse=True):
+        if known in name:
+            return (*WEAPONS[known], int(magic.group(1)) if magic else 0)
+    return (*DEFAULT_WEAPON, int(magic.group(1)) if magic else 0)
+
+
+def parse_player_attack(message: str) -> tuple[int, int] | None:
+    """Read a declared attack roll and damage from a player's message.
+
+    Matches the format documented in the README, e.g. "I attack you rolling a
+    14 to hit for 4 damage", so common attacks need no LLM call.
+
+    Args:
+        message: The player's message
+
+    Returns:
+        A tuple of (attack roll, damage), or None if the message does not match.
+    """
+    match = _PLAYER_ATTACK_PATTERN.search(message)
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+@dataclass(frozen=True)
+class CombatProfile:
+    """Precomputed attack and defence numbers for one character"""
+
+    armor_class: int
+    max_hp: int
+    attack_bonus: int
+    damage_dice: int
+    damage_die: int
+    damage_bonus: int
+    initiative_bonus: int
+    weapon: str
+
+    @classmethod
+    def from_template(cls, template: dict) -> "CombatProfile":
+        """Build a combat profile from a cleaned character template.
+
+        Args:
+            template: A template with attributes, level, weapon, AC and HP keys
+
+        Returns:
+            The CombatProfile for the template.
+        """
+        scores = dict(zip(ATTRIBUTE_NAMES, parse_attributes(template.get("attributes", ""))))
+        strength = ability_modifier(scores["Str"])
+        dexterity = ability_modifier(scores["Dex"])
+        weapon = template.get("weapon") or "Unarmed strike"
+        dice, die, ability, magic = parse_weapon(weapon)
+        modifier = {
+            "str": strength,
+            "dex": dexterity,
+            "finesse": max(strength, dexterity),
+        }[ability]
+        try:
+            level = int(template.get("level", 1))
+        except (TypeError, ValueError):
+            level = 1
+        return cls(
+            armor_class=int(template.get("AC", DEFAULT_AC)),
+            max_hp=max(1, int(template.get("HP", DEFAULT_HP))),
+            attack_bonus=modifier + proficiency_bonus(level) + magic,
+            # Unarmed strikes deal 1 + Str damage
+            damage_dice=dice,
+            damage_die=die,
+            damage_bonus=modifier + magic + (1 if dice == 0 else 0),
+            initiative_bonus=dexterity,
+            weapon=weapon,
+        )
+
+
+@dataclass(frozen=True)
+class AttackResult:
+    """Outcome of a single resolved attack"""
+
+    d20_roll: int
+    attack_total: int
+    damage: int
+    is_critical: bool
+    is_fumble: bool
+    hit: bool | None
+
+
+class CombatEngine:
+    """Seedable D&D dice roller for single attacks and batched simulations"""
+
+    def __init__(self, seed: int | None = None):
+        self.rng = np.random.default_rng(seed)
+
+    def _roll_damage(self, profile: CombatProfile, critical: np.ndarray) -> np.ndarray:
+        """Roll weapon damage for each attack, doubling the dice on critical hits."""
+        size = len(critical)
+        if profile.damage_dice == 0:
+            dice_total = np.zeros(size, dtype=np.int64)
+        else:
+            rolls = self.rng.integers(
+                1, profile.damage_die + 1, size=(size, 2 * profile.damage_dice)
+            )
+            dice_count = np.where(critical, 2 * profile.damage_dice, profile.damage_dice)
+            used = np.arange(2 * profile.damage_dice) < dice_count[:, None]
+            dice_total = (rolls * used).sum(axis=1)
+        return np.maximum(dice_total + profile.damage_bonus, 0)
+
+    def attack_batch(
+        self,
+        profile: CombatProfile,
+        target_ac: np.ndarray | int,
+        size: int,
+    ) -> np.ndarray:
+        """Resolve many attacks at once and return the damage each one deals.
+
+        A natural 20 always hits and doubles the damage dice, a natural 1 always
+        misses, otherwise the attack hits if d20 + attack bonus >= target AC.
+
+        Args:
+            profile: The attacker's combat profile
+            target_ac: The defender's AC, a scalar or one value per attack
+            size: Number of attacks
+
+        Returns:
+            An int array of damage dealt, 0 for misses.
+        """
+        d20 = self.rng.integers(1, 21, size=size)
+        critical = d20 == 20
+        hit = (d20 != 1) & (critical | (d20 + profile.attack_bonus >= target_ac))
+        return np.where(hit, self._roll_damage(profile, critical), 0)
+
+    def attack(self, profile: CombatProfile, target_ac: int | None = None) -> AttackResult:
+        """Resolve a single attack.
+
+        Args:
+            profile: The attacker's combat profile
+            target_ac: The defender's AC, or None if it is unknown and the player
+                decides whether the attack total hits
+
+        Returns:
+            The AttackResult, with damage rolled even if the hit is undecided.
+        """
+        d20 = int(self.rng.integers(1, 21))
+        is_critical, is_fumble = d20 == 20, d20 == 1
+        attack_total = d20 + profile.attack_bonus
+        damage = int(self._roll_damage(profile, np.array([is_critical]))[0])
+        hit = None
+        if is_critical or is_fumble:
+            hit = is_critical
+        elif target_ac is not None:
+            hit = attack_total >= target_ac
+        return AttackResult(
+            d20_roll=d20,
+            attack_total=attack_total,
+            damage=damage if hit is not False else 0,
+            is_critical=is_critical,
+            is_fumble=is_fumble,
+            hit=hit,
+        )
+
+    @staticmethod
+    def resolve_incoming(attack_roll: int, profile: CombatProfile) -> bool:
+        """Decide whether a declared attack roll hits a defender.
+
+        Args:
+            attack_roll: The attacker's total attack roll
+            profile: The defender's combat profile
+
+        Returns:
+            True if the attack roll meets or beats the defender's AC.
+        """
+        return int(attack_roll) >= profile.armor_class
+
+    def simulate(
+        self,
+        first: CombatProfile,
+        second: CombatProfile,
+        encounters: int,
+        max_rounds: int = MAX_SIMULATED_ROUNDS,
+    ) -> dict:
+        """Simulate many one-on-one fights to the death in vectorised batches.
+
+        Each encounter rolls initiative, then both sides attack once per round
+        in initiative order until one drops to 0 HP or max_rounds is reached.
+
+        Args:
+            first: The first combatant's profile
+            second: The second combatant's profile
+            encounters: Number of independent fights to simulate
+            max_rounds: Round limit after which a fight counts as a draw
+
+        Returns:
+            A dictionary with the first and second combatants' win rates, the
+            draw rate and the mean number of rounds.
+        """
+        hp = {
+            "first": np.full(encounters, first.max_hp, dtype=np.int64),
+            "second": np.full(encounters, second.max_hp, dtype=np.int64),
+        }
+        first_goes_first = (
+            self.rng.integers(1, 21, size=encounters) + first.initiative_bonus
+            >= self.rng.integers(1, 21, size=encounters) + second.initiative_bonus
+        )
+        rounds = np.zeros(encounters, dtype=np.int64)
+        active = np.ones(encounters, dtype=bool)
+        for _ in range(max_rounds):
+            if not active.any():
+                break
+            rounds += active
+            first_damage = self.attack_batch(first, second.armor_class, encounters)
+            second_damage = self.attack_batch(second, first.armor_class, encounters)
+            # The combatant acting second only strikes if still standing
+            second_hp_after = hp["second"] - np.where(active & first_goes_first, first_damage, 0)
+            first_hp_after = hp["first"] - np.where(
+                active & ~first_goes_first, second_damage, 0
+            )
+            second_strikes = active & first_goes_first & (second_hp_after > 0)
+            first_strikes = active & ~first_goes_first & (first_hp_after > 0)
+            hp["second"] = second_hp_after - np.where(first_strikes, first_damage, 0)
+            hp["first"] = first_hp_after - np.where(second_strikes, second_damage, 0)
+            active &= (hp["first"] > 0) & (hp["second"] > 0)
+        first_wins = (hp["second"] <= 0) & (hp["first"] > 0)
+        second_wins = (hp["first"] <= 0) & (hp["second"] > 0)
+        return {
+            "first_win_rate": float(first_wins.mean()),
+            "second_win_rate": float(second_wins.mean()),
+            "draw_rate": float((~first_wins & ~second_wins).mean()),
+            "mean_rounds": float(rounds.mean()),
+        }
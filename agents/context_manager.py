@@ -0,0 +1,212 @@
+"""Prompt context assembly under a token budget.
+
+Instead of pasting the full character JSON and raw "Player: ... You: ..."
+transcripts into every system prompt, the NPC's prompts are assembled from:
+    - A compact character sheet and the turn's instructions, always included
+    - A rolling per-sender summary of the conversation, updated in the
+      background every few turns so summarising never delays a reply
+    - The sender's turns since the last summary, most recent first
+    - The most relevant stored memories, in ranked order
+    - Dialogue style exemplars
+
+Optional sections are added in priority order until the token budget is used
+up, truncating the last one that only partly fits. Tokens are estimated from
+the character count, which is close enough for budgeting and needs no
+tokenizer.
+
+Key Components:
+    ContextManager: Keeps per-sender summaries and assembles budgeted prompts
+    character_sheet: Compact one-paragraph rendering of a character template
+    estimate_tokens: Approximate token count of a text
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Hard limit on estimated system prompt tokens
+PROMPT_TOKEN_BUDGET = 300
+# Past interactions retrieved as memory candidates for each prompt
+MEMORY_RESULTS = 3
+# Turns between background summary updates for a sender
+SUMMARY_INTERVAL = 6
+# Approximate length of the rolling summary, in words
+SUMMARY_WORDS = 80
+# Average characters per token of English text for common tokenizers
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text from its length."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Cut a text to at most max_tokens estimated tokens, marking the cut."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[: max(0, max_tokens * CHARS_PER_TOKEN - 3)] + "..."
+
+
+def character_sheet(template: dict) -> str:
+    """Render a character template as a compact character sheet.
+
+    Args:
+        template: A cleaned character template
+
+    Returns:
+        A short paragraph with the same facts as the template's JSON.
+
+    Examples:
+        >>> character_sheet({"race": "Human", "class": "Wizard", "level": 3, "HP": 14})
+        'Level 3 Human Wizard. HP 14.'
+    """
+    subclass = f" ({template['subclass']})" if template.get("subclass") else ""
+    parts = [
+        f"Level {template.get('level', 1)} {template.get('race', '')} "
+        f"{template.get('class', '')}{subclass}".replace("  ", " ")
+    ]
+    for label, key in (
+        ("Background", "background"),
+        ("Alignment", "alignment"),
+        ("HP", "HP"),
+        ("AC", "AC"),
+        ("Abilities", "attributes"),
+        ("Weapon", "weapon"),
+        ("Skills", "skills"),
+        ("Feats", "feats"),
+    ):
+        if template.get(key) not in (None, ""):
+            parts.append(f"{label} {template[key]}")
+    return ". ".join(parts) + "."
+
+
+@dataclass
+class _SenderContext:
+    """Conversation state kept for one sender"""
+
+    summary: str = ""
+    # Turns not yet folded into the summary, oldest first
+    recent_turns: list[str] = field(default_factory=list)
+    summary_task: asyncio.Task | None = None
+
+
+class ContextManager:
+    """Keeps rolling per-sender summaries and assembles budgeted prompts
+
+    Args:
+        summarize: Coroutine function taking (previous summary, new turns) and
+            returning the updated summary
+        budget: Maximum estimated tokens of an assembled prompt
+        summary_interval: Turns between background summary updates
+    """
+
+    def __init__(
+        self,
+        summarize: Callable[[str, list[str]], Awaitable[str]],
+        budget: int = PROMPT_TOKEN_BUDGET,
+        summary_interval: int = SUMMARY_INTERVAL,
+    ):
+        self.summarize = summarize
+        self.budget = budget
+        self.summary_interval = summary_interval
+        self.senders: dict[str, _SenderContext] = {}
+
+    def record_turn(self, sender: str, turn: str):
+        """Add a finished turn and start a summary update every summary_interval turns.
+
+        Args:
+            sender: Address of the player
+            turn: The turn text, e.g. "Player: ...\\nYou: ..."
+        """
+        context = self.senders.setdefault(sender, _SenderContext())
+        context.recent_turns.append(turn)
+        updating = context.summary_task is not None and not context.summary_task.done()
+        if len(context.recent_turns) >= self.summary_interval and not updating:
+            context.summary_task = asyncio.create_task(self._update_summary(context))
+
+    async def _update_summary(self, context: _SenderContext):
+        """Fold the sender's recent turns into their summary."""
+        turns = list(context.recent_turns)
+        try:
+            context.summary = await self.summarize(context.summary, turns)
+        except Exception as e:
+            logger.error(f"Failed to update conversation summary: {e}")
+            # Keep the turns for the next attempt, but not without bound
+            excess = len(context.recent_turns) - 4 * self.summary_interval
+            del context.recent_turns[: max(0, excess)]
+            return
+        # Turns recorded while summarising stay for the next update
+        del context.recent_turns[: len(turns)]
+
+    def summary(self, sender: str) -> str:
+        """Return the current conversation summary for a sender."""
+        context = self.senders.get(sender)
+        return context.summary if context else ""
+
+    def assemble(
+        self,
+        sender: str,
+        header: str,
+        instructions: str,
+        memories: list[str],
+        exemplars: list[str],
+    ) -> str:
+        """Assemble a system prompt within the token budget.
+
+        The header and instructions are always included. The remaining budget
+        goes to, in order: the first style exemplar, the conversation summary,
+        the latest turn, the most relevant memory, the other recent turns newest
+        first, the other memories in ranked order and then the remaining
+        exemplars. Memories already among the recent turns are skipped.
+
+        Args:
+            sender: Address of the player
+            header: Who the NPC is, e.g. the name and character sheet
+            instructions: What the NPC should do this turn
+            memories: Relevant past interactions, most relevant first
+            exemplars: Dialogue style examples
+
+        Returns:
+            The system prompt, with at most budget estimated tokens unless the
+            header and instructions alone exceed it.
+        """
+        context = self.senders.get(sender) or _SenderContext()
+        recent = context.recent_turns[::-1]
+        memories = [memory for memory in memories if memory not in recent]
+        candidates = [
+            ("Dialogue style", exemplars[:1]),
+            ("Conversation so far", [context.summary] if context.summary else []),
+            ("Recent turns", recent[:1]),
+            ("Relevant memories", memories[:1]),
+            ("Recent turns", recent[1:]),
+            ("Relevant memories", memories[1:]),
+            ("More dialogue style", exemplars[1:]),
+        ]
+        remaining = (
+            self.budget - estimate_tokens(f"{header}\n") - estimate_tokens(instructions)
+        )
+        sections = {}
+        for label, items in candidates:
+            for item in items:
+                if remaining <= 0:
+                    break
+                # Each item is preceded by a newline, and each section by its label
+                overhead = 1 + (0 if label in sections else estimate_tokens(f"{label}:\n"))
+                text = _truncate(item, remaining - overhead)
+                if not text or text == "...":
+                    remaining = 0
+                    break
+                sections.setdefault(label, []).append(text)
+                remaining -= overhead + estimate_tokens(text)
+        style = sections.pop("Dialogue style", []) + sections.pop("More dialogue style", [])
+        if style:
+            sections = {"Dialogue style": style, **sections}
+        body = "".join(
+            f"{label}:\n" + "".join(f"{item}\n" for item in items)
+            for label, items in sections.items()
+        )
+        return f"{header}\n{body}{instructions}"
@@ -0,0 +1,384 @@
+"""Portable prebuilt index bundles.
+
+An index bundle is the self-describing export written by scripts/process_data.py:
+a manifest recording the embedding model, embedding dimension, source data
+fingerprints and collection parameters, plus the vectors, ids, documents and
+metadata of each collection in a memory-mappable layout. Loading a bundle lets
+the NPC agent start without re-ingesting the dialogue and template data.
+
+Loading only checks the manifest, file sizes, array shapes and the size of any
+local source data, so it stays fast. Full SHA-256 verification is done once,
+after copying a bundle to a new machine:
+    $ uv run -m agents.index_bundle verify ./index_bundle
+
+Key Components:
+    export_index_bundle: Write collections as a bundle
+    load_index_bundle: Validate a bundle and open its collections
+    verify_index_bundle: Check every bundle and source file against its hash
+    BundleCollection: Read-only collection with a ChromaDB-compatible query method
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+
+logger = logging.getLogger(__name__)
+
+INDEX_BUNDLE_PATH = Path("./index_bundle")
+INDEX_BUNDLE_FORMAT_VERSION = 2
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+DATA_PATH = Path(__file__).parent.parent / "data"
+
+
+def sha256_file(path: Path) -> str:
+    """Return the hex SHA-256 digest of a file, read in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_files(directory: str, pattern: str) -> list[Path]:
+    """Return the sorted source files matching a pattern under DATA_PATH."""
+    return sorted((DATA_PATH / directory).glob(pattern))
+
+
+def fingerprint_source(directory: str, pattern: str, with_hash: bool = True) -> dict:
+    """Fingerprint the source data files matching a pattern under DATA_PATH.
+
+    Args:
+        directory: Directory relative to DATA_PATH
+        pattern: Glob pattern of the files within the directory
+        with_hash: Whether to include a SHA-256 over the file names and contents
+
+    Returns:
+        A dictionary with the file count, total bytes and optionally the hash.
+    """
+    paths = _source_files(directory, pattern)
+    fingerprint = {
+        "directory": directory,
+        "pattern": pattern,
+        "files": len(paths),
+        "bytes": sum(path.stat().st_size for path in paths),
+    }
+    if with_hash:
+        digest = hashlib.sha256()
+        for path in paths:
+            digest.update(path.name.encode("utf-8"))
+            digest.update(sha256_file(path).encode("ascii"))
+        fingerprint["sha256"] = digest.hexdigest()
+    return fingerprint
+
+
+def _write_string_column(strings: list[str], directory: Path, name: str):
+    """Write strings as one UTF-8 blob plus an int64 offsets array.
+
+    String i is blob[offsets[i]:offsets[i + 1]], so readers can memory-map both
+    files and decode single entries without parsing the whole column.
+    """
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(item) for item in encoded], out=offsets[1:])
+    with open(directory / f"{name}.bin", "wb") as file:
+        for item in encoded:
+            file.write(item)
+    np.save(directory / f"{name}.offsets.npy", offsets)
+
+
+def export_index_bundle(
+    bundle_path: Path,
+    collections: dict[str, dict],
+    sources: dict[str, tuple[str, str]],
+):
+    """Export collections as a self-describing, memory-mappable index bundle.
+
+    Layout:
+        manifest.json: format version, embedding model and dim, source data
+            fingerprints, collection parameters and the size and SHA-256 of
+            every bundle file
+        <collection>/embeddings.npy: L2-normalised float32 vectors
+        <collection>/ids.bin, ids.offsets.npy: ids as a string column
+        <collection>/documents.bin, documents.offsets.npy: documents as a string column
+        <collection>/metadatas.bin, metadatas.offsets.npy: JSON-encoded metadata
+            per document as a string column, if the collection has any
+
+    Args:
+        bundle_path: Directory to write the bundle to, replaced if it exists
+        collections: Mapping of collection name to a dict with documents, ids,
+            embeddings, metadatas (or None) and the collection metadata
+        sources: Mapping of source name to (directory under DATA_PATH, glob
+            pattern) of the data the bundle was built from
+    """
+    if bundle_path.exists():
+        shutil.rmtree(bundle_path)
+    manifest = {
+        "format_version": INDEX_BUNDLE_FORMAT_VERSION,
+        "created_at": datetime.now().isoformat(),
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "embedding_dim": None,
+        "normalized": True,
+        "source_data": {
+            name: fingerprint_source(directory, pattern)
+            for name, (directory, pattern) in sources.items()
+        },
+        "collections": {},
+    }
+    for name, collection in collections.items():
+        directory = bundle_path / name
+        directory.mkdir(parents=True)
+        embeddings = collection["embeddings"]
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        np.save(directory / "embeddings.npy", embeddings / np.maximum(norms, 1e-12))
+        _write_string_column(collection["ids"], directory, "ids")
+        _write_string_column(collection["documents"], directory, "documents")
+        if collection["metadatas"] is not None:
+            _write_string_column(
+                [json.dumps(metadata) for metadata in collection["metadatas"]],
+                directory,
+                "metadatas",
+            )
+        manifest["embedding_dim"] = int(embeddings.shape[1])
+        manifest["collections"][name] = {
+            "count": len(collection["documents"]),
+            "metadata": collection["metadata"],
+            "has_metadatas": collection["metadatas"] is not None,
+            "files": {
+                path.name: {"bytes": path.stat().st_size, "sha256": sha256_file(path)}
+                for path in sorted(directory.iterdir())
+            },
+        }
+    with open(bundle_path / "manifest.json", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    logger.info(f"Index bundle exported to {bundle_path}")
+
+
+class StringColumn:
+    """Memory-mapped column of UTF-8 strings stored as a blob plus offsets."""
+
+    def __init__(self, directory: Path, name: str):
+        self.offsets = np.load(directory / f"{name}.offsets.npy", mmap_mode="r")
+        blob_path = directory / f"{name}.bin"
+        if blob_path.stat().st_size:
+            with open(blob_path, "rb") as file:
+                self.blob = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.blob = b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return self.blob[start:end].decode("utf-8")
+
+
+class JsonColumn(StringColumn):
+    """Memory-mapped column of JSON values, decoded one entry at a time."""
+
+    def __getitem__(self, index: int):
+        return json.loads(super().__getitem__(index))
+
+
+class BundleCollection:
+    """Read-only vector collection loaded from an index bundle.
+
+    Performs exact cosine search over the memory-mapped, L2-normalised vectors
+    and returns results in the same shape as chromadb's Collection.query, so it
+    can stand in for the dialogue and template collections.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        directory: Path,
+        embedding_function,
+        has_metadatas: bool,
+    ):
+        self.name = name
+        self.embeddings = np.load(directory / "embeddings.npy", mmap_mode="r")
+        self.ids = StringColumn(directory, "ids")
+        self.documents = StringColumn(directory, "documents")
+        self.metadatas = JsonColumn(directory, "metadatas") if has_metadatas else None
+        self._embedding_function = embedding_function
+
+    def count(self) -> int:
+        """Return the number of documents in the collection."""
+        return len(self.ids)
+
+    def query(self, query_texts: list[str], n_results: int = 10) -> dict:
+        """Find the documents most similar to each query text.
+
+        Args:
+            query_texts: The texts to search for
+            n_results: Number of results to return per query
+
+        Returns:
+            A dictionary with ids, documents, metadatas and distances keys, each
+            holding one list of results per query text.
+        """
+        queries = np.asarray(self._embedding_function(query_texts), dtype=np.float32)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        similarities = queries @ self.embeddings.T
+        n_results = min(n_results, self.count())
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for row in similarities:
+            top = np.argpartition(-row, n_results - 1)[:n_results] if n_results else []
+            top = sorted(top, key=lambda i: -row[i])
+            results["ids"].append([self.ids[i] for i in top])
+            results["documents"].append([self.documents[i] for i in top])
+            results["metadatas"].append(
+                [self.metadatas[i] if self.metadatas is not None else None for i in top]
+            )
+            results["distances"].append([float(1 - row[i]) for i in top])
+        return results
+
+
+def read_manifest(bundle_path: Path) -> dict:
+    """Read and validate a bundle manifest against what this agent expects.
+
+    Args:
+        bundle_path: Directory containing the bundle
+
+    Returns:
+        The parsed manifest.
+
+    Raises:
+        ValueError: If the manifest is missing or unreadable, from another format
+            version or built with a different embedding model.
+    """
+    manifest_path = bundle_path / "manifest.json"
+    if not manifest_path.exists():
+        raise ValueError(f"No index bundle manifest at {manifest_path}")
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+    except (OSError, json.JSONDecodeError) as e:
+        raise ValueError(f"Unreadable index bundle manifest: {e}") from e
+    if manifest.get("format_version") != INDEX_BUNDLE_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported index bundle format: {manifest.get('format_version')}"
+        )
+    if manifest.get("embedding_model") != EMBEDDING_MODEL_NAME:
+        raise ValueError(
+            f"Index bundle built with {manifest.get('embedding_model')}, "
+            f"expected {EMBEDDING_MODEL_NAME}"
+        )
+    return manifest
+
+
+def _check_source_data(manifest: dict, with_hash: bool):
+    """Check that local source data, where present, matches the bundle's.
+
+    Sources that do not exist locally are skipped, since a deployed agent only
+    needs the bundle.
+
+    Raises:
+        ValueError: If local source data differs from what the bundle was built from.
+    """
+    for name, expected in manifest["source_data"].items():
+        if not (DATA_PATH / expected["directory"]).exists():
+            logger.info(f"No local {name} data, skipping source check")
+            continue
+        local = fingerprint_source(expected["directory"], expected["pattern"], with_hash)
+        for key in ("files", "bytes", "sha256") if with_hash else ("files", "bytes"):
+            if local[key] != expected[key]:
+                raise ValueError(
+                    f"Index bundle is stale: local {name} {key} is {local[key]}, "
+                    f"bundle was built from {expected[key]}"
+                )
+
+
+def load_index_bundle(
+    bundle_path: Path = INDEX_BUNDLE_PATH,
+    collection_names: tuple[str, ...] = ("character_dialogue", "character_templates"),
+) -> dict[str, BundleCollection]:
+    """Validate an index bundle and open the requested collections.
+
+    Checks the manifest, the size of every bundle file, the shape of the vectors
+    and the file count and size of any local source data, without hashing.
+
+    Args:
+        bundle_path: Directory containing the bundle
+        collection_names: Collections that must be present in the bundle
+
+    Returns:
+        A dictionary mapping collection name to BundleCollection.
+
+    Raises:
+        ValueError: If the bundle is missing, incomplete, incompatible or stale.
+    """
+    manifest = read_manifest(bundle_path)
+    try:
+        _check_source_data(manifest, with_hash=False)
+        embedding_function = DefaultEmbeddingFunction()
+        collections = {}
+        for name in collection_names:
+            entry = manifest["collections"].get(name)
+            if entry is None:
+                raise ValueError(f"Index bundle has no {name} collection")
+            directory = bundle_path / name
+            for file_name, expected in entry["files"].items():
+                size = (directory / file_name).stat().st_size
+                if size != expected["bytes"]:
+                    raise ValueError(
+                        f"{name}/{file_name} is {size} bytes, expected {expected['bytes']}"
+                    )
+            collection = BundleCollection(
+                name, directory, embedding_function, entry["has_metadatas"]
+            )
+            expected_shape = (entry["count"], manifest["embedding_dim"])
+            if collection.embeddings.shape != expected_shape:
+                raise ValueError(
+                    f"{name} embeddings have shape {collection.embeddings.shape}, "
+                    f"expected {expected_shape}"
+                )
+            if len(collection.ids) != entry["count"]:
+                raise ValueError(
+                    f"{name} has {len(collection.ids)} ids, expected {entry['count']}"
+                )
+            collections[name] = collection
+    except (OSError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid index bundle at {bundle_path}: {e!r}") from e
+    logger.info(f"Loaded index bundle from {bundle_path}")
+    return collections
+
+
+def verify_index_bundle(bundle_path: Path = INDEX_BUNDLE_PATH):
+    """Check every bundle file and any local source data against its SHA-256.
+
+    Args:
+        bundle_path: Directory containing the bundle
+
+    Raises:
+        ValueError: If any file is missing or does not match its hash.
+    """
+    manifest = read_manifest(bundle_path)
+    try:
+        _check_source_data(manifest, with_hash=True)
+        for name, entry in manifest["collections"].items():
+            for file_name, expected in entry["files"].items():
+                if sha256_file(bundle_path / name / file_name) != expected["sha256"]:
+                    raise ValueError(f"Checksum mismatch for {name}/{file_name}")
+    except (OSError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid index bundle at {bundle_path}: {e!r}") from e
+    logger.info(f"Index bundle at {bundle_path} verified")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Index bundle tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    verify_parser = subparsers.add_parser("verify", help="check all bundle checksums")
+    verify_parser.add_argument("bundle_path", type=Path, nargs="?", default=INDEX_BUNDLE_PATH)
+    args = parser.parse_args()
+    if args.command == "verify":
+        verify_index_bundle(args.bundle_path)
@@ -6,11 +6,16 @@ in natural conversation, remember past interactions, and participate in combat m
 The NPCAgent class creates immersive tabletop RPG characters by:
     - Generating character stats and attributes from natural language descriptions
     - Using RAG (Retrieval Augmented Generation) with Critical Role dialogue examples
-    - Maintaining conversation memory across interactions
-    - Implementing D&D combat mechanics including HP tracking and dice rolls
+    - Maintaining conversation memory across interactions, with a rolling
+      per-player summary and prompts assembled under a token budget
+    - Checkpointing runtime state so a restarted agent resumes without LLM calls
+    - Rate limiting, coalescing and fairly queueing messages before any LLM call
+    - Implementing D&D combat mechanics including HP tracking and dice rolls,
+      resolved locally by agents.combat so the LLM only narrates the outcome
     - Integrating with the fetch.ai uAgents framework for distributed agent communication
 
-The agent leverages ChromaDB for vector storage and retrieval of:
+The agent leverages ChromaDB (or a prebuilt index bundle, see agents.index_bundle)
+for vector storage and retrieval of:
     - Character dialogue examples (from Critical Role dataset)
     - D&D character templates (stats, abilities, backgrounds)
     - NPC conversation memories
@@ -22,6 +27,9 @@ Environment Variables Required:
     ASI_API_KEY: API key for ASI-CLOUD inference (OpenAI-compatible endpoint)
     AGENTVERSE_API_KEY: API key for fetch.ai Agentverse platform
 
+Optional Environment Variables:
+    NPC_COMBAT_SEED: Integer seed for the combat dice, to make fights replayable
+
 Usage:
     Run this module directly to create and deploy a D&D NPC agent:
         $ uv run -m agents.npc_agent
@@ -38,10 +46,10 @@ Attribution:
     Framework structure: Fetch.ai RAG agent example
 """
 
+import atexit
 import os
 import json
 import logging
-import random
 from datetime import datetime
 from uuid import uuid4
 
@@ -56,9 +64,24 @@ from uagents_core.contrib.protocols.chat import (
 )
 from openai import OpenAI, AsyncOpenAI
 
+from agents.admission import RATE_LIMITED, AdmissionController
+from agents.combat import CombatEngine, CombatProfile, parse_player_attack
+from agents.context_manager import (
+    MEMORY_RESULTS,
+    SUMMARY_WORDS,
+    ContextManager,
+    character_sheet,
+)
+from agents.index_bundle import INDEX_BUNDLE_PATH, load_index_bundle
+from agents.state_store import StateStore, session_id
+from agents.template_store import TemplateStore
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Number of semantic template matches to check against the requested filters
+TEMPLATE_CANDIDATES = 20
+
 # Load environment variables
 load_dotenv()
 
@@ -71,15 +94,26 @@ class NPCAgent:
             path="./chromadb",
         )
         try:
-            self.dialogue_collection = db.get_collection("character_dialogue")
-        except Exception as e:
-            logger.error(f"Dialogue collection not found: {e}")
-            raise
+            bundle = load_index_bundle(INDEX_BUNDLE_PATH)
+            self.dialogue_collection = bundle["character_dialogue"]
+            self.template_collection = bundle["character_templates"]
+        except ValueError as e:
+            logger.info(f"Index bundle not used, falling back to ChromaDB: {e}")
+            try:
+                self.dialogue_collection = db.get_collection("character_dialogue")
+            except Exception as e:
+                logger.error(f"Dialogue collection not found: {e}")
+                raise
+            try:
+                self.template_collection = db.get_collection("character_templates")
+            except Exception as e:
+                logger.error(f"Template collection not found: {e}")
+                raise
         try:
-            self.template_collection = db.get_collection("character_templates")
-        except Exception as e:
-            logger.error(f"Template collection not found: {e}")
-            raise
+            self.template_store = TemplateStore()
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Template table not used, falling back to metadata: {e}")
+            self.template_store = None
         try:
             db.delete_collection("npc_memories")
             logger.info("Previous memories deleted!")
@@ -98,16 +132,31 @@ class NPCAgent:
             base_url="https://inference.asicloud.cudos.org/v1",
         )
         self.DEFAULT_SITUATION = "standing in your usual location"
+        combat_seed = os.getenv("NPC_COMBAT_SEED")
+        self.combat_engine = CombatEngine(int(combat_seed) if combat_seed else None)
+        self.combat_profile = None
         self.is_dead = False
         self.is_hostile = False
         self.npc_name = None
         self.description = None
         self.character_template = None
+        self.character_json = None
+        self.character_sheet = None
         self.dialogue_style = None
         self.personality = None
         self.max_hp = None
         self.current_hp = None
-        self.setup_from_description(description)
+        self.context_manager = ContextManager(self._summarize_conversation)
+        self.state_store = StateStore()
+        atexit.register(self.state_store.close)
+        self.session_id = session_id(description)
+        saved_state = self.state_store.get(self.session_id)
+        if saved_state is not None:
+            self._restore_state(saved_state)
+            logger.info(f"Recovered state for {self.npc_name} ({self.session_id})")
+        else:
+            self.setup_from_description(description)
+            self._checkpoint()
         self.uagent = Agent(
             name=self.npc_name,
             seed="npc_agent_seed",
@@ -116,6 +165,7 @@ class NPCAgent:
             publish_agent_details=True,
             readme_path="AGENT_README.md",
         )
+        self.admission = AdmissionController(self._take_turn, self._busy_reply)
         self.setup_protocol()
 
     def _get_dialogue_style(
@@ -155,7 +205,8 @@ class NPCAgent:
         """Retrieve a matching D&D character template from the database.
 
         Queries the template collection using semantic search on the description,
-        with optional filters for specific character attributes.
+        then prefers the closest candidate that also matches the optional filters
+        in the typed template store.
 
         Args:
             description: Natural language description of the character
@@ -170,28 +221,44 @@ class NPCAgent:
         Raises:
             ValueError: If no matching character template is found in the database.
         """
-        template_list = []
-        if race:
-            template_list.append({"race": {"$eq": race}})
-        if npc_class:
-            template_list.append({"class": {"$eq": npc_class}})
-        if level:
-            template_list.append({"level": {"$eq": level}})
-        if background:
-            template_list.append({"background": {"$eq": background}})
-
+        if self.template_store is None:
+            results = self.template_collection.query(
+                query_texts=[description],
+                n_results=1,
+            )
+            if not results["metadatas"] or not results["metadatas"][0]:
+                raise ValueError("No matching character template found")
+            return results["metadatas"][0][0]
+        try:
+            level = int(level) if level else None
+        except (TypeError, ValueError):
+            level = None
+        matching = set(
+            self.template_store.filter(
+                race=race,
+                npc_class=npc_class,
+                level=level,
+                background=background,
+            ).tolist()
+        )
         results = self.template_collection.query(
             query_texts=[description],
-            n_results=1,
+            n_results=TEMPLATE_CANDIDATES,
         )
-        if not results["metadatas"] or not results["metadatas"][0]:
+        if not results["ids"] or not results["ids"][0]:
             raise ValueError("No matching character template found")
-        return results["metadatas"][0][0]
+        indices = [self.template_store.index_of(i) for i in results["ids"][0]]
+        if indices[0] is None:
+            # Template table is out of date with the collection, use its metadata
+            return results["metadatas"][0][0]
+        chosen = next((i for i in indices if i in matching), indices[0])
+        return self.template_store.template(chosen)
 
     def _store_npc_memory(
         self,
         interaction: str,
         npc_id: str,
+        sender: str | None = None,
     ) -> str:
         """Store an interaction in the NPC's memory collection.
 
@@ -201,14 +268,18 @@ class NPCAgent:
         Args:
             interaction: The text of the interaction to store
             npc_id: Unique identifier for the NPC
+            sender: Optional address of the player the interaction was with
 
         Returns:
             The string 'stored' upon successful storage.
         """
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        metadata = {"npc_id": npc_id, "timestamp": timestamp}
+        if sender is not None:
+            metadata["sender"] = sender
         self.memory_collection.add(
             documents=[interaction],
-            metadatas=[{"npc_id": npc_id, "timestamp": timestamp}],
+            metadatas=[metadata],
             ids=[f"{npc_id}_{timestamp}"],
         )
         return "stored"
@@ -217,6 +288,7 @@ class NPCAgent:
         self,
         context: str,
         npc_id: str,
+        sender: str | None = None,
     ):
         """Retrieve relevant past interactions from the NPC's memory.
 
@@ -226,39 +298,82 @@ class NPCAgent:
         Args:
             context: The current context or query to search for similar memories
             npc_id: Unique identifier for the NPC whose memories to search
+            sender: Optional address of the player to restrict the memories to
 
         Returns:
-            A list of relevant memory documents, or an empty list if no memories found.
+            A list of up to MEMORY_RESULTS relevant memory documents, most relevant
+            first, or an empty list if no memories found.
         """
+        where = {"npc_id": npc_id}
+        if sender is not None:
+            where = {"$and": [where, {"sender": sender}]}
         results = self.memory_collection.query(
             query_texts=[context],
-            where={"npc_id": npc_id},
-            n_results=1,
+            where=where,
+            n_results=MEMORY_RESULTS,
         )
         return results["documents"][0] if results["documents"] else []
 
     def _perform_attack(self) -> dict:
-        """Simulate an NPC attack by rolling a d20.
+        """Resolve an NPC weapon attack with the combat engine.
 
-        Performs a d20 dice roll and returns attack information including whether
-        it's a critical hit (20) or fumble (1).
+        Rolls a d20 plus the NPC's attack bonus and the weapon's damage from the
+        precomputed combat profile. The player's AC is unknown, so unless the
+        roll is a critical hit (20) or fumble (1) the player decides whether the
+        attack total hits.
 
         Returns:
             A dictionary containing:
                 - d20_roll: The dice roll result (1-20)
+                - attack_total: d20 roll plus the NPC's attack bonus
+                - damage: Damage dealt if the attack hits, 0 on a fumble
+                - weapon: The weapon used for the attack
                 - is_critical: True if roll is 20 (critical hit)
                 - is_fumble: True if roll is 1 (fumble)
                 - npc_character_template: The NPC's full character template with stats
         """
-        roll = random.randint(1, 20)
+        result = self.combat_engine.attack(self.combat_profile)
         attack_information = {
-            "d20_roll": roll,
-            "is_critical": roll == 20,
-            "is_fumble": roll == 1,
+            "d20_roll": result.d20_roll,
+            "attack_total": result.attack_total,
+            "damage": result.damage,
+            "weapon": self.combat_profile.weapon,
+            "is_critical": result.is_critical,
+            "is_fumble": result.is_fumble,
             "npc_character_template": self.character_template,
         }
         return attack_information
 
+    def _runtime_state(self) -> dict:
+        """Return the NPC state that is checkpointed between turns."""
+        return {
+            "npc_name": self.npc_name,
+            "description": self.description,
+            "personality": self.personality,
+            "character_template": self.character_template,
+            "dialogue_style": self.dialogue_style,
+            "max_hp": self.max_hp,
+            "current_hp": self.current_hp,
+            "is_hostile": self.is_hostile,
+            "is_dead": self.is_dead,
+        }
+
+    def _checkpoint(self):
+        """Queue the changed parts of the NPC state for the background state writer."""
+        self.state_store.record(self.session_id, self._runtime_state())
+
+    def _restore_state(self, state: dict):
+        """Restore NPC attributes from a checkpoint instead of calling the LLM.
+
+        Args:
+            state: A checkpoint produced by _runtime_state
+        """
+        for field, value in state.items():
+            setattr(self, field, value)
+        self.character_json = json.dumps(self.character_template, indent=2)
+        self.character_sheet = character_sheet(self.character_template)
+        self.combat_profile = CombatProfile.from_template(self.character_template)
+
     def setup_from_description(self, description: str):
         """Initialize NPC attributes from a natural language description.
 
@@ -273,6 +388,7 @@ class NPCAgent:
             Sets the following instance attributes:
                 - description: The original description
                 - character_template: D&D character stats and abilities
+                - combat_profile: Attack and defence numbers derived from the template
                 - max_hp: Maximum hit points
                 - current_hp: Current hit points
                 - personality: Extracted personality trait
@@ -317,7 +433,10 @@ class NPCAgent:
             level=structured_response.get("level"),
             background=structured_response.get("background"),
         )
-        self.max_hp = self.current_hp = self.character_template.get("HP", 20)
+        self.character_json = json.dumps(self.character_template, indent=2)
+        self.character_sheet = character_sheet(self.character_template)
+        self.combat_profile = CombatProfile.from_template(self.character_template)
+        self.max_hp = self.current_hp = self.combat_profile.max_hp
         self.personality = structured_response.get("personality", "neutral temperament")
         self.dialogue_style = self._get_dialogue_style(
             self.personality,
@@ -326,6 +445,46 @@ class NPCAgent:
         retrieved_npc_name = structured_response.get("npc_name")
         self.npc_name = retrieved_npc_name or "Gerald"
 
+    async def _take_turn(self, sender: str, text: str) -> str:
+        """Generate and checkpoint the response to an admitted turn.
+
+        Args:
+            sender: Address of the player
+            text: The player's message, or several coalesced messages
+
+        Returns:
+            The NPC's response, or an error message if generation failed.
+        """
+        if self.is_dead:
+            return f"*{self.npc_name} lies on the ground, cold...*"
+        try:
+            return await self.generate_response(text, sender)
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            return f"Sorry, I encountered an error: {str(e)}"
+        finally:
+            # Damage or hostility may have changed even if narration failed
+            self._checkpoint()
+
+    def _busy_reply(self, outcome: str) -> str:
+        """Return an in-character reply for a message that was not admitted.
+
+        Args:
+            outcome: The admission outcome, RATE_LIMITED or QUEUE_FULL
+
+        Returns:
+            A short reply sent without calling the LLM.
+        """
+        if outcome == RATE_LIMITED:
+            return (
+                f"*{self.npc_name} holds up a hand.* One thing at a time! "
+                f"Let me catch my breath before you go on."
+            )
+        return (
+            f"*{self.npc_name} is surrounded by a crowd and can't hear you over "
+            f"the din.* Come back in a moment, would you?"
+        )
+
     def setup_protocol(self):
         """Set up uAgent chat protocol"""
         protocol = Protocol(spec=chat_protocol_spec)
@@ -350,21 +509,23 @@ class NPCAgent:
 
                 logger.info(f"Received message from: {sender}")
 
-                # Generate response using RAG + LLM
+                async def send_reply(response: str):
+                    """Send a response back to the user"""
+                    await ctx.send(
+                        sender,
+                        ChatMessage(
+                            timestamp=datetime.now(),
+                            msg_id=uuid4(),
+                            content=[TextContent(type="text", text=response)],
+                        ),
+                    )
+                    logger.info(f"Sent NPC response to {sender}")
+
                 if self.is_dead:
-                    response = f"*{self.npc_name} lies on the ground, cold...*"
+                    await send_reply(f"*{self.npc_name} lies on the ground, cold...*")
                 else:
-                    response = await self.generate_response(user_text)
-                # Send response back to user
-                await ctx.send(
-                    sender,
-                    ChatMessage(
-                        timestamp=datetime.now(),
-                        msg_id=uuid4(),
-                        content=[TextContent(type="text", text=response)],
-                    ),
-                )
-                logger.info(f"Sent NPC response to {sender}")
+                    # Response is generated with RAG + LLM once the turn is admitted
+                    await self.admission.submit(sender, user_text, send_reply)
             except Exception as e:
                 logger.error(f"Error handling message: {e}")
                 # Send error response
@@ -395,7 +556,14 @@ class NPCAgent:
         self.uagent.include(protocol, publish_manifest=True)
 
     async def _check_for_damage(self, player_message: str) -> tuple[bool, int, int]:
-        """Parse player's attack roll and damage from their message"""
+        """Parse player's attack roll and damage from their message.
+
+        Attacks written in the documented "rolling a X to hit for Y damage" form
+        are parsed locally; the LLM is only asked about other phrasings.
+        """
+        declared_attack = parse_player_attack(player_message)
+        if declared_attack is not None:
+            return True, *declared_attack
         system_content = (
             """Extract attack roll and damage from this message if present:\n"""
             """
@@ -426,9 +594,9 @@ class NPCAgent:
             return False, None, None
 
     def _apply_damage(self, attack_roll: int, damage: int) -> dict:
-        """Check if attack hits and apply damage"""
-        ac = self.character_template.get("armor_class", 10)
-        hit = int(attack_roll) >= int(ac)
+        """Check if attack hits against the template's AC and apply damage"""
+        ac = self.combat_profile.armor_class
+        hit = self.combat_engine.resolve_incoming(attack_roll, self.combat_profile)
 
         if hit:
             self.current_hp = max(0, int(self.current_hp) - damage)
@@ -471,18 +639,54 @@ class NPCAgent:
             "hostile", self.is_hostile
         ), structured_response.get("reason", "")
 
-    async def generate_response(self, query: str) -> str:
+    async def _summarize_conversation(self, summary: str, turns: list[str]) -> str:
+        """Fold new conversation turns into a player's rolling summary.
+
+        Args:
+            summary: The summary so far, empty for a new conversation
+            turns: The turns since the summary was last updated, oldest first
+
+        Returns:
+            The updated summary.
+        """
+        transcript = "\n".join(turns)
+        system_content = (
+            f"""You are {self.npc_name}'s memory. Update the summary of your """
+            f"""conversation with this player using the new turns. Keep names, """
+            f"""promises, grudges, combat and anything the player revealed. """
+            f"""Write in the second person ("You ...") in at most """
+            f"""{SUMMARY_WORDS} words, and return only the summary."""
+        )
+        response = await self.async_client.chat.completions.create(
+            model="openai/gpt-oss-20b",
+            messages=[
+                {"role": "system", "content": system_content},
+                {
+                    "role": "user",
+                    "content": (
+                        f"Summary so far: {summary or 'None'}\n\n"
+                        f"New turns:\n{transcript}"
+                    ),
+                },
+            ],
+        )
+        return response.choices[0].message.content.strip() or summary
+
+    async def generate_response(self, query: str, sender: str = "player") -> str:
         """Generate an in-character response to a player's message.
 
         Handles the complete response generation pipeline including:
         - Checking for combat actions (attacks, damage)
         - Detecting provocations that might trigger NPC hostility
         - Retrieving relevant memories from past interactions
+        - Assembling the prompt under the context manager's token budget
         - Generating contextual, personality-driven responses
         - Managing combat state and hit points
 
         Args:
             query: The player's message or action
+            sender: Address of the player, used to keep their conversation
+                summary and memories separate from other players'
 
         Returns:
             The NPC's in-character response, potentially including combat information
@@ -492,9 +696,10 @@ class NPCAgent:
             - May update is_hostile flag
             - May update is_dead flag
             - May reduce current_hp if attacked
-            - Stores the interaction in memory
+            - Stores the interaction in memory and the player's conversation context
         """
-        character_json = json.dumps(self.character_template, indent=2)
+        header = f"You are {self.npc_name}.\nCharacter: {self.character_sheet}"
+        npc_memories = []
         combat_summary = ""
         is_attack, attack_roll, damage = await self._check_for_damage(query)
         if is_attack:
@@ -509,57 +714,57 @@ class NPCAgent:
                     f"Final blow dealt: {damage} damage."
                 )
             if player_attack_result["hit"]:
-                system_content = (
-                    f"You are {self.npc_name}.\n"
+                instructions = (
+                    f"The player's attack roll of {attack_roll} beat your AC of "
+                    f"{player_attack_result['ac']}.\n"
                     f"You just took: {damage} damage from the player.\n"
-                    f"Character: {character_json}\n"
                     f"Your HP: {self.current_hp}/{self.max_hp}\n"
                     f"Respond in character to the player's attack."
                 )
             else:
-                system_content = (
-                    f"You are {self.npc_name}.\n"
-                    f"The player attempted to attack you but missed.\n"
-                    f"Character: {character_json}\n"
+                instructions = (
+                    f"The player's attack roll of {attack_roll} missed your AC of "
+                    f"{player_attack_result['ac']}.\n"
                     f"Your HP: {self.current_hp}/{self.max_hp}\n"
                     f"Respond in character to the player's attack."
                 )
         else:
             is_hostile, reason = await self._check_for_provocation(query)
             self.is_hostile = is_hostile
-            retrieved_memories = self._retrieve_npc_memory(query, self.uagent.name)
-            npc_memories = (
-                retrieved_memories[0] if retrieved_memories else "First encounter."
-            )
+            npc_memories = self._retrieve_npc_memory(query, self.uagent.name, sender)
             if self.is_hostile:
                 attack_information = self._perform_attack()
                 logger.info(f"Combat triggered: {reason}")
-                system_content = (
-                    f"You are {self.npc_name}.\n"
-                    f"Character: {character_json}\n"
-                    f"Dialogue style: {self.dialogue_style}\n"
-                    f"Past interactions: {npc_memories}\n"
+                instructions = (
                     f"The player provoked you {reason}. You attack!\n"
+                    f"Weapon: {attack_information['weapon']}\n"
+                    f"Attack roll: {attack_information['attack_total']}, "
+                    f"damage if it hits: {attack_information['damage']}\n"
                     f"{'CRITICAL HIT!' if attack_information['is_critical'] else ''}\n"
                     f"{'FUMBLE!' if attack_information['is_fumble'] else ''}\n\n"
-                    f"Describe your attack in character."
+                    f"Describe your attack in character. The dice have been rolled, "
+                    f"do not change the numbers."
                 )
                 combat_summary = (
                     f"\n\n---\n"
                     f"**COMBAT INITIATED**\n\n"
                     f"D20 Roll: {attack_information['d20_roll']}\n\n"
+                    f"Attack Roll: {attack_information['attack_total']} "
+                    f"({attack_information['weapon']})\n\n"
+                    f"Damage: {attack_information['damage']}\n\n"
                     f"{'CRITICAL HIT!\n' if attack_information['is_critical'] else ''}"
                     f"{'FUMBLE!\n' if attack_information['is_fumble'] else ''}"
-                    f"**Character Stats:**\n\n```json\n{character_json}\n```"
+                    f"**Character Stats:**\n\n```json\n{self.character_json}\n```"
                 )
             else:
-                system_content = (
-                    f"You are {self.npc_name}.\n"
-                    f"Character: {character_json}\n"
-                    f"Dialogue style: {self.dialogue_style}\n"
-                    f"Past interactions: {npc_memories}\n"
-                    f"Respond in character to the player's message."
-                )
+                instructions = "Respond in character to the player's message."
+        system_content = self.context_manager.assemble(
+            sender,
+            header,
+            instructions,
+            npc_memories,
+            self.dialogue_style,
+        )
         response = await self.async_client.chat.completions.create(
             model="asi1-mini",
             messages=[
@@ -568,15 +773,14 @@ class NPCAgent:
             ],
         )
         npc_reply = response.choices[0].message.content
-        npc_reply += combat_summary
         if not npc_reply:
             logger.error("Empty response from LLM")
             return "I'm not sure how to respond..."
-        self._store_npc_memory(
-            f"Player: {query}\nYou: {npc_reply}",
-            self.uagent.name,
-        )
-        return npc_reply
+        # Remember the exchange without the combat stats block
+        interaction = f"Player: {query}\nYou: {npc_reply}"
+        self._store_npc_memory(interaction, self.uagent.name, sender)
+        self.context_manager.record_turn(sender, interaction)
+        return npc_reply + combat_summary
 
     def run(self):
         """Start the uAgent and begin listening for chat messages.
@@ -0,0 +1,178 @@
+"""Crash-safe checkpoints of NPC runtime state.
+
+NPC state (HP, hostility, death, the derived template and dialogue style) is
+checkpointed as an append-only journal of per-session deltas plus a compact
+snapshot of every session. Writes happen on a background thread so that a
+checkpoint only costs a dictionary diff and a queue put on the message path,
+and on restart the latest state is rebuilt by loading the snapshot and
+replaying the journal, with no LLM calls.
+
+Deltas set whole field values, so replaying a journal entry that is already in
+the snapshot (after a crash between writing the snapshot and truncating the
+journal) gives the same state.
+
+Key Components:
+    StateStore: Records state deltas in the background and recovers all sessions
+    session_id: Stable session key for an NPC description
+"""
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+STATE_PATH = Path("./npc_state")
+SNAPSHOT_FILE = "snapshot.json"
+JOURNAL_FILE = "journal.ndjson"
+# Journal entries written before the snapshot is rewritten and the journal truncated
+SNAPSHOT_INTERVAL = 1000
+
+# Queue marker asking the writer thread to stop
+_STOP = object()
+
+
+def session_id(description: str) -> str:
+    """Return the session key for an NPC description.
+
+    Restarting an agent with the same description recovers the same session.
+    """
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()[:16]
+
+
+class StateStore:
+    """Append-only journal and snapshot store for NPC session state
+
+    Args:
+        path: Directory holding the snapshot and journal files
+        snapshot_interval: Journal entries between snapshot compactions
+    """
+
+    def __init__(self, path: Path = STATE_PATH, snapshot_interval: int = SNAPSHOT_INTERVAL):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.snapshot_interval = snapshot_interval
+        self.sessions, self._journal_entries = self._recover()
+        # Last state recorded per session, used to compute deltas on the caller's thread
+        self._recorded = {key: dict(state) for key, state in self.sessions.items()}
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(
+            target=self._write_loop, name="npc-state-writer", daemon=True
+        )
+        self._writer.start()
+
+    def _recover(self) -> tuple[dict[str, dict], int]:
+        """Load the snapshot and replay the journal on top of it.
+
+        A truncated final journal line, left by a crash mid-write, is dropped.
+
+        Returns:
+            The latest state of every session keyed by session id, and the
+            number of journal lines replayed.
+        """
+        sessions = {}
+        line_number = 0
+        snapshot_path = self.path / SNAPSHOT_FILE
+        if snapshot_path.exists():
+            with open(snapshot_path, "r", encoding="utf-8") as file:
+                sessions = json.load(file)
+        journal_path = self.path / JOURNAL_FILE
+        if journal_path.exists():
+            with open(journal_path, "rb+") as file:
+                complete_bytes = 0
+                for line_number, line in enumerate(file, start=1):
+                    if not line.endswith(b"\n"):
+                        # Drop the partial line so new entries start on a fresh one
+                        logger.warning(f"Dropping truncated state journal line {line_number}")
+                        file.truncate(complete_bytes)
+                        break
+                    complete_bytes += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(
+                            f"Ignoring unreadable state journal line {line_number}"
+                        )
+                        continue
+                    sessions.setdefault(entry["session"], {}).update(entry["delta"])
+        return sessions, line_number
+
+    def get(self, key: str) -> dict | None:
+        """Return the recovered or last written state of a session, or None."""
+        state = self.sessions.get(key)
+        return dict(state) if state is not None else None
+
+    def record(self, key: str, state: dict):
+        """Checkpoint a session's state.
+
+        Only the fields that changed since the last call are queued for the
+        writer thread, so unchanged turns cost a dictionary comparison.
+
+        Args:
+            key: The session id
+            state: The session's full JSON-serialisable state
+        """
+        previous = self._recorded.setdefault(key, {})
+        delta = {
+            field: value
+            for field, value in state.items()
+            if field not in previous or previous[field] != value
+        }
+        if not delta:
+            return
+        previous.update(delta)
+        self._queue.put((key, delta))
+
+    def _write_loop(self):
+        """Append queued deltas to the journal and compact it periodically."""
+        journal = open(self.path / JOURNAL_FILE, "a", encoding="utf-8")
+        entries = self._journal_entries
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            # Drain whatever else is queued so that one flush covers many deltas
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for item in batch:
+                if item is _STOP:
+                    stopping = True
+                    continue
+                key, delta = item
+                self.sessions.setdefault(key, {}).update(delta)
+                journal.write(json.dumps({"session": key, "delta": delta}) + "\n")
+                entries += 1
+            journal.flush()
+            if entries >= self.snapshot_interval or (stopping and entries):
+                journal.close()
+                self._write_snapshot()
+                journal = open(self.path / JOURNAL_FILE, "w", encoding="utf-8")
+                entries = 0
+            for _ in batch:
+                self._queue.task_done()
+        journal.close()
+
+    def _write_snapshot(self):
+        """Atomically replace the snapshot with the current state of all sessions."""
+        temporary_path = self.path / f"{SNAPSHOT_FILE}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(self.sessions, file, separators=(",", ":"))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.path / SNAPSHOT_FILE)
+
+    def flush(self):
+        """Block until every recorded delta has been written to the journal."""
+        self._queue.join()
+
+    def close(self):
+        """Write all pending deltas, compact them into the snapshot and stop the writer."""
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
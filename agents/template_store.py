@@ -0,0 +1,180 @@
+"""Typed character template store.
+
+Loads the columnar template table written by scripts/clean_metadata.py: a NumPy
+structured array holding level, HP, AC and ability scores as integers and the
+string fields as categorical codes. Templates can be filtered with vectorised
+comparisons and looked up by hash without going through ChromaDB metadata.
+
+Key Components:
+    TemplateStore: Loads the table and provides filtering and template lookup
+    parse_attributes: Parse a flattened attributes string into ability scores
+"""
+
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_TABLE_PATH = (
+    Path(__file__).parent.parent / "data" / "character_templates" / "dnd_templates_table"
+)
+TEMPLATE_TABLE_VERSION = 2
+ATTRIBUTE_NAMES = ("Str", "Dex", "Con", "Int", "Wis", "Cha")
+CATEGORICAL_FIELDS = (
+    "race",
+    "background",
+    "class",
+    "subclass",
+    "alignment",
+    "weapon",
+    "feats",
+    "skills",
+)
+# Category codes are int32 as high-cardinality fields such as skills outgrow int16
+TEMPLATE_DTYPE = np.dtype(
+    [
+        ("level", np.int16),
+        ("HP", np.int32),
+        ("AC", np.int16),
+        ("attributes", np.int16, (len(ATTRIBUTE_NAMES),)),
+        *((field, np.int32) for field in CATEGORICAL_FIELDS),
+    ]
+)
+
+
+def parse_attributes(attributes: str) -> list[int]:
+    """Parse a flattened attributes string into integer ability scores.
+
+    Args:
+        attributes: Flattened attributes, e.g. "Str: 13, Dex: 16, ..."
+
+    Returns:
+        The six ability scores in ATTRIBUTE_NAMES order, 10 for any that are missing.
+
+    Examples:
+        >>> parse_attributes("Str: 13, Dex: 16, Con: 13, Int: 15, Wis: 15, Cha: 14")
+        [13, 16, 13, 15, 15, 14]
+    """
+    scores = dict.fromkeys(ATTRIBUTE_NAMES, 10)
+    for item in attributes.split(", "):
+        name, _, score = item.partition(": ")
+        if name in scores and score.lstrip("-").isdigit():
+            scores[name] = int(score)
+    return list(scores.values())
+
+
+class TemplateStore:
+    """Columnar store of D&D character templates
+
+    Raises:
+        OSError: If the table files are missing or unreadable.
+        ValueError: If the table was written for a different version or dtype.
+    """
+
+    def __init__(self, path: Path = TEMPLATE_TABLE_PATH):
+        with open(path / "strings.json", "r", encoding="utf-8") as file:
+            strings = json.load(file)
+        if strings.get("version") != TEMPLATE_TABLE_VERSION:
+            raise ValueError(f"Unsupported template table version: {strings.get('version')}")
+        self.records = np.load(path / "templates.npy")
+        if self.records.dtype != TEMPLATE_DTYPE:
+            raise ValueError(f"Unexpected template table dtype: {self.records.dtype}")
+        self.attribute_names = strings["attribute_names"]
+        self.categories = strings["categories"]
+        self.hashes = strings["hash"]
+        self.summaries = strings["summary"]
+        self._codes = {
+            field: {value: code for code, value in enumerate(values)}
+            for field, values in self.categories.items()
+        }
+        self._index_by_hash = {
+            template_hash: index for index, template_hash in enumerate(self.hashes)
+        }
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def index_of(self, template_hash: str) -> int | None:
+        """Return the row index of a template hash, or None if it is not stored."""
+        return self._index_by_hash.get(template_hash)
+
+    def filter(
+        self,
+        race: str | None = None,
+        npc_class: str | None = None,
+        background: str | None = None,
+        level: int | None = None,
+        min_level: int | None = None,
+        max_level: int | None = None,
+        min_hp: int | None = None,
+        max_hp: int | None = None,
+    ) -> np.ndarray:
+        """Find templates matching all of the given criteria.
+
+        Args:
+            race: Exact race (e.g., 'Human', 'Elf')
+            npc_class: Exact class (e.g., 'Fighter', 'Wizard')
+            background: Exact background (e.g., 'Soldier')
+            level: Exact character level
+            min_level: Minimum character level, inclusive
+            max_level: Maximum character level, inclusive
+            min_hp: Minimum hit points, inclusive
+            max_hp: Maximum hit points, inclusive
+
+        Returns:
+            An array of the matching row indices, empty if an unknown category
+            value was requested.
+        """
+        mask = np.ones(len(self.records), dtype=bool)
+        for field, value in (("race", race), ("class", npc_class), ("background", background)):
+            if value is None:
+                continue
+            code = self._codes[field].get(value)
+            if code is None:
+                return np.empty(0, dtype=np.intp)
+            mask &= self.records[field] == code
+        if level is not None:
+            mask &= self.records["level"] == level
+        if min_level is not None:
+            mask &= self.records["level"] >= min_level
+        if max_level is not None:
+            mask &= self.records["level"] <= max_level
+        if min_hp is not None:
+            mask &= self.records["HP"] >= min_hp
+        if max_hp is not None:
+            mask &= self.records["HP"] <= max_hp
+        return np.flatnonzero(mask)
+
+    def attributes(self, index: int) -> dict[str, int]:
+        """Return a template's ability scores keyed by attribute name."""
+        return dict(
+            zip(self.attribute_names, self.records[index]["attributes"].tolist())
+        )
+
+    def template(self, index: int) -> dict:
+        """Return a template in the cleaned template dictionary format.
+
+        Args:
+            index: Row index of the template
+
+        Returns:
+            A dictionary with the same keys and value types as the entries of
+            dnd_templates_cleaned.json.
+        """
+        record = self.records[index]
+        template = {"hash": self.hashes[index]}
+        for field in ("race", "background", "class", "subclass"):
+            template[field] = self.categories[field][record[field]]
+        template["level"] = int(record["level"])
+        template["feats"] = self.categories["feats"][record["feats"]]
+        template["HP"] = int(record["HP"])
+        template["AC"] = int(record["AC"])
+        template["attributes"] = ", ".join(
+            f"{name}: {score}" for name, score in self.attributes(index).items()
+        )
+        for field in ("alignment", "skills", "weapon"):
+            template[field] = self.categories[field][record[field]]
+        return template
@@ -0,0 +1,787 @@
+"""Benchmarks for the data pipeline and NPC agent internals.
+
+Run from the repository root so that both the scripts and agents packages are
+importable, e.g.:
+    $ uv run -m scripts.benchmark embedding --workers 1 2 4 8
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import tempfile
+import time
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def benchmark_embedding(worker_counts: list[int], limit: int):
+    """Report CPU embedding throughput in docs per second for each worker count.
+
+    Args:
+        worker_counts: The worker pool sizes to measure
+        limit: Maximum number of dialogue documents to embed per run
+    """
+    from scripts.process_data import embed_documents, load_dialogue_documents
+
+    documents = load_dialogue_documents()[:limit]
+    for num_workers in worker_counts:
+        start = time.perf_counter()
+        embed_documents(documents, num_workers)
+        elapsed = time.perf_counter() - start
+        logger.info(
+            f"workers={num_workers}: {len(documents)} docs in {elapsed:.1f}s "
+            f"({len(documents) / elapsed:.0f} docs/s)"
+        )
+
+
+def benchmark_bundle(bundle_path: Path, rebuild: bool):
+    """Compare index bundle load time against a full ChromaDB rebuild.
+
+    After loading, queries run in the order the agent makes them at startup: the
+    template query, which also loads the query embedding model, then the
+    dialogue query, which scans every dialogue vector, then the dialogue query
+    again with the vectors in the page cache.
+
+    Args:
+        bundle_path: Directory of the index bundle to load
+        rebuild: Whether to also time a full rebuild into a temporary directory
+    """
+    from agents.index_bundle import load_index_bundle, verify_index_bundle
+
+    start = time.perf_counter()
+    collections = load_index_bundle(bundle_path)
+    logger.info(f"bundle load: {time.perf_counter() - start:.2f}s")
+    for name, collection, query in (
+        ("first template query", "character_templates", "a grumpy dwarf wizard"),
+        ("first dialogue query", "character_dialogue", "rude standing in the tavern"),
+        ("warm dialogue query", "character_dialogue", "nervous hiding in the forest"),
+    ):
+        start = time.perf_counter()
+        collections[collection].query(query_texts=[query], n_results=1)
+        logger.info(
+            f"{name}: {time.perf_counter() - start:.2f}s over "
+            f"{collections[collection].count()} vectors"
+        )
+    start = time.perf_counter()
+    verify_index_bundle(bundle_path)
+    logger.info(f"one-off checksum verification: {time.perf_counter() - start:.2f}s")
+    if rebuild:
+        from scripts.process_data import main as process_data
+
+        with tempfile.TemporaryDirectory() as db_path:
+            start = time.perf_counter()
+            process_data(os.cpu_count() or 1, db_path=db_path, bundle_path=None)
+            logger.info(f"full rebuild: {time.perf_counter() - start:.1f}s")
+
+
+def _max_rss_mb() -> float:
+    """Return the peak resident set size of this process in MiB (Linux units)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark_templates(repeats: int):
+    """Compare the typed template store against the JSON plus ChromaDB path.
+
+    Reports load time and peak RSS growth for each representation, and the mean
+    latency of filtering by class, level range and HP range.
+
+    Args:
+        repeats: Number of filter calls to average over
+    """
+    from agents.template_store import TemplateStore
+    from scripts.clean_metadata import TEMPLATE_DATA_PATH
+
+    rss = _max_rss_mb()
+    start = time.perf_counter()
+    store = TemplateStore()
+    logger.info(
+        f"typed table: load {1000 * (time.perf_counter() - start):.1f}ms, "
+        f"peak RSS +{_max_rss_mb() - rss:.1f}MiB"
+    )
+    start = time.perf_counter()
+    for _ in range(repeats):
+        store.filter(npc_class="Wizard", min_level=5, max_level=10, min_hp=20, max_hp=60)
+    logger.info(f"typed table: filter {1e6 * (time.perf_counter() - start) / repeats:.0f}us")
+
+    rss = _max_rss_mb()
+    start = time.perf_counter()
+    with open(TEMPLATE_DATA_PATH / "dnd_templates_cleaned.json", "r", encoding="utf-8") as file:
+        templates = json.load(file)
+    logger.info(
+        f"cleaned JSON: load {1000 * (time.perf_counter() - start):.1f}ms, "
+        f"peak RSS +{_max_rss_mb() - rss:.1f}MiB"
+    )
+    start = time.perf_counter()
+    for _ in range(repeats):
+        [
+            template
+            for template in templates.values()
+            if template["class"] == "Wizard"
+            and 5 <= template["level"] <= 10
+            and 20 <= template["HP"] <= 60
+        ]
+    logger.info(f"cleaned JSON: filter {1e6 * (time.perf_counter() - start) / repeats:.0f}us")
+
+    import chromadb
+
+    collection = chromadb.PersistentClient(path="./chromadb").get_collection(
+        "character_templates"
+    )
+    where = {
+        "$and": [
+            {"class": {"$eq": "Wizard"}},
+            {"level": {"$gte": 5}},
+            {"level": {"$lte": 10}},
+            {"HP": {"$gte": 20}},
+            {"HP": {"$lte": 60}},
+        ]
+    }
+    start = time.perf_counter()
+    for _ in range(repeats):
+        collection.get(where=where, include=["metadatas"])
+    logger.info(f"chromadb metadata: filter {1e6 * (time.perf_counter() - start) / repeats:.0f}us")
+
+
+def _synthetic_raw_record(template: dict) -> dict:
+    """Rebuild a raw dnd_chars_unique.json style record from a cleaned template."""
+    return {
+        "hash": [template["hash"]],
+        "race": {"race": [template["race"]]},
+        "background": [template["background"]],
+        "class": {
+            template["class"]: {
+                "class": [template["class"]],
+                "subclass": [template["subclass"]],
+            }
+        },
+        "level": [template["level"]],
+        "feats": template["feats"].split(", ") if template["feats"] else [],
+        "HP": [template["HP"]],
+        "AC": [template["AC"]],
+        "attributes": {
+            name: [score]
+            for name, _, score in (
+                item.partition(": ") for item in template["attributes"].split(", ")
+            )
+        },
+        "alignment": {"alignment": [template["alignment"]]},
+        "skills": template["skills"].split(", ") if template["skills"] else [],
+        "weapons": [template["weapon"]] if template["weapon"] else [],
+    }
+
+
+def _write_synthetic_raw_dataset(path: Path, copies: int):
+    """Write a raw template dataset enlarged by repeating every template copies times."""
+    from scripts.clean_metadata import read_cleaned_templates
+
+    templates = dict(read_cleaned_templates())
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("{")
+        for copy in range(copies):
+            for index, (char_summary, template) in enumerate(templates.items()):
+                separator = ", " if copy or index else ""
+                file.write(f"{separator}{json.dumps(f'{char_summary} #{copy}')}: ")
+                json.dump(_synthetic_raw_record(template), file, indent=2)
+        file.write("}")
+
+
+def _run_in_memory_clean(input_path: Path, output_dir: Path):
+    """Clean the way clean_metadata.py used to: load everything, dump indented JSON."""
+    from scripts.clean_metadata import clean_template
+
+    with open(input_path, "r", encoding="utf-8") as file:
+        raw_data = json.load(file)
+    cleaned = {summary: clean_template(record) for summary, record in raw_data.items()}
+    with open(output_dir / "cleaned.json", "w", encoding="utf-8") as file:
+        json.dump(cleaned, file, indent=2)
+
+
+def _run_streaming_clean(input_path: Path, output_dir: Path, workers: int):
+    """Clean with the streaming cleaner, writing NDJSON and the typed table."""
+    from scripts.clean_metadata import main as clean_metadata
+
+    clean_metadata(
+        input_path,
+        "ndjson",
+        workers,
+        table_path=output_dir / "table",
+        output_path=output_dir / "cleaned.ndjson",
+    )
+
+
+def _measure_clean(queue, function, *args):
+    """Run a cleaner and report its runtime, its own peak RSS and its workers'.
+
+    The children figure is the peak RSS of the largest terminated worker, as
+    reported by RUSAGE_CHILDREN.
+    """
+    start = time.perf_counter()
+    function(*args)
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    queue.put((time.perf_counter() - start, _max_rss_mb(), children_rss))
+
+
+def benchmark_cleaning(copies: int, workers: int):
+    """Compare peak RSS and runtime of in-memory and streaming template cleaning.
+
+    Each cleaner runs in a fresh process on a synthetic raw dataset built by
+    repeating the cleaned templates, so peak RSS is measured independently.
+
+    Args:
+        copies: How many times to repeat the template dataset
+        workers: Process count for the parallel streaming run
+    """
+    import multiprocessing
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        input_path = directory / "raw.json"
+        _write_synthetic_raw_dataset(input_path, copies)
+        size_mb = input_path.stat().st_size / (1 << 20)
+        runs = {
+            "in-memory": (0, _run_in_memory_clean, input_path, directory),
+            "streaming": (0, _run_streaming_clean, input_path, directory, 1),
+            f"streaming x{workers}": (
+                workers,
+                _run_streaming_clean,
+                input_path,
+                directory,
+                workers,
+            ),
+        }
+        for name, (pool_size, function, *args) in runs.items():
+            queue = context.Queue()
+            process = context.Process(target=_measure_clean, args=(queue, function, *args))
+            process.start()
+            elapsed, peak_rss, worker_rss = queue.get()
+            process.join()
+            # Upper bound, as RUSAGE_CHILDREN only reports the largest worker
+            total_rss = peak_rss + pool_size * worker_rss
+            logger.info(
+                f"{name}: {size_mb:.0f}MiB input in {elapsed:.1f}s, peak RSS "
+                f"{peak_rss:.0f}MiB main + {pool_size} x {worker_rss:.0f}MiB workers "
+                f"(<= {total_rss:.0f}MiB total)"
+            )
+
+
+def benchmark_combat(turns: int, encounters: int, seed: int):
+    """Report per-turn combat latency and encounters simulated per second.
+
+    Per-turn latency covers the local work of one combat turn: parsing the
+    player's declared attack, resolving it against the NPC's AC and rolling the
+    NPC's attack. Simulation throughput is measured for random template pairs.
+
+    Args:
+        turns: Number of combat turns to average over
+        encounters: Number of encounters simulated per template pair
+        seed: Seed for the combat engine and template sampling
+    """
+    import numpy as np
+
+    from agents.combat import CombatEngine, CombatProfile, parse_player_attack
+    from agents.template_store import TemplateStore
+
+    store = TemplateStore()
+    rng = np.random.default_rng(seed)
+    start = time.perf_counter()
+    profiles = [
+        CombatProfile.from_template(store.template(int(index)))
+        for index in rng.choice(len(store), size=min(len(store), 1000), replace=False)
+    ]
+    logger.info(
+        f"profiles: {1e6 * (time.perf_counter() - start) / len(profiles):.0f}us "
+        f"per template"
+    )
+
+    engine = CombatEngine(seed)
+    profile = profiles[0]
+    message = "I swing my sword at you, rolling a 15 to hit for 7 damage"
+    start = time.perf_counter()
+    for _ in range(turns):
+        attack_roll, damage = parse_player_attack(message)
+        engine.resolve_incoming(attack_roll, profile)
+        engine.attack(profile)
+    logger.info(f"combat turn: {1e6 * (time.perf_counter() - start) / turns:.1f}us")
+
+    pairs = 20
+    start = time.perf_counter()
+    for _ in range(pairs):
+        first, second = rng.choice(len(profiles), size=2, replace=False)
+        engine.simulate(profiles[first], profiles[second], encounters)
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"simulation: {pairs * encounters} encounters in {elapsed:.2f}s "
+        f"({pairs * encounters / elapsed:,.0f} encounters/s)"
+    )
+
+
+def benchmark_state(sessions: int, turns: int):
+    """Report per-turn checkpoint overhead and recovery time for many sessions.
+
+    Each session starts with a full state built from a real template, then every
+    turn changes its HP and hostility as a fight would. The checkpoint overhead
+    is the time spent on the caller's thread; the background writer is drained
+    separately before recovering every session into a fresh store.
+
+    Args:
+        sessions: Number of NPC sessions to checkpoint
+        turns: Number of turns per session
+    """
+    from agents.state_store import StateStore
+    from agents.template_store import TemplateStore
+
+    store = TemplateStore()
+    states = {
+        f"session-{index}": {
+            "npc_name": f"NPC {index}",
+            "description": f"Benchmark NPC {index}",
+            "personality": "rude",
+            "character_template": store.template(index % len(store)),
+            "dialogue_style": ["Oh, you're here again."],
+            "max_hp": 40,
+            "current_hp": 40,
+            "is_hostile": False,
+            "is_dead": False,
+        }
+        for index in range(sessions)
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        state_store = StateStore(Path(directory))
+        start = time.perf_counter()
+        for key, state in states.items():
+            state_store.record(key, state)
+        logger.info(
+            f"initial checkpoint: {1e6 * (time.perf_counter() - start) / sessions:.1f}us "
+            f"per session"
+        )
+        elapsed = 0.0
+        for turn in range(turns):
+            for key, state in states.items():
+                state["current_hp"] = max(0, state["current_hp"] - turn % 7)
+                state["is_hostile"] = turn % 3 != 0
+                state["is_dead"] = state["current_hp"] == 0
+                start = time.perf_counter()
+                state_store.record(key, state)
+                elapsed += time.perf_counter() - start
+        logger.info(
+            f"per-turn checkpoint: {1e6 * elapsed / (sessions * turns):.1f}us "
+            f"on the message path"
+        )
+        start = time.perf_counter()
+        state_store.flush()
+        logger.info(f"background writer drained in {time.perf_counter() - start:.2f}s")
+        # As after a crash: the snapshot plus the journal since the last compaction
+        start = time.perf_counter()
+        recovered = StateStore(Path(directory))
+        logger.info(
+            f"recovery from snapshot + journal: {len(recovered.sessions)} sessions in "
+            f"{1000 * (time.perf_counter() - start):.1f}ms"
+        )
+        if any(recovered.get(key) != state for key, state in states.items()):
+            logger.error("Recovered state does not match the checkpointed state")
+        recovered.close()
+        state_store.close()
+        # As after a clean shutdown, which compacts everything into the snapshot
+        start = time.perf_counter()
+        recovered = StateStore(Path(directory))
+        logger.info(
+            f"recovery from snapshot: {len(recovered.sessions)} sessions in "
+            f"{1000 * (time.perf_counter() - start):.1f}ms"
+        )
+        recovered.close()
+
+
+def _percentile(values: list[float], percentile: float) -> float:
+    """Return a percentile of a list of values, or NaN if it is empty."""
+    import numpy as np
+
+    return float(np.percentile(values, percentile)) if values else float("nan")
+
+
+def _jain_index(values: list[float]) -> float:
+    """Return Jain's fairness index: 1.0 when all values are equal, 1/n at worst."""
+    total = sum(values)
+    squares = sum(value * value for value in values)
+    return total * total / (len(values) * squares) if squares else 1.0
+
+
+class _MockTransport:
+    """Records when each simulated message was sent and when it was answered.
+
+    A turn's reply answers every message its sender sent before the turn
+    started, so coalesced messages are answered by one reply.
+    """
+
+    def __init__(self):
+        self.outstanding = {}
+        self.started = {}
+        self.latencies = {}
+        self.busy_latencies = []
+        self.turns = {}
+
+    def send(self, sender: str) -> float:
+        """Record a message from a sender and return its send time."""
+        sent_at = time.perf_counter()
+        self.outstanding.setdefault(sender, []).append(sent_at)
+        return sent_at
+
+    def start_turn(self, sender: str):
+        """Record that a turn for a sender has started."""
+        self.started[sender] = time.perf_counter()
+        self.turns[sender] = self.turns.get(sender, 0) + 1
+
+    def reply(self, sender: str):
+        """Record a turn reply to a sender."""
+        now = time.perf_counter()
+        started = self.started[sender]
+        remaining = []
+        for sent_at in self.outstanding[sender]:
+            if sent_at <= started:
+                self.latencies.setdefault(sender, []).append(now - sent_at)
+            else:
+                remaining.append(sent_at)
+        self.outstanding[sender] = remaining
+
+    def busy(self, sender: str, sent_at: float):
+        """Record an immediate busy reply to a message."""
+        self.outstanding[sender].remove(sent_at)
+        self.busy_latencies.append(time.perf_counter() - sent_at)
+
+
+async def _run_load(
+    admitted: bool,
+    senders: int,
+    duration: float,
+    llm_latency: float,
+    workers: int,
+    seed: int,
+) -> _MockTransport:
+    """Drive one chatty sender and many normal senders against a mock NPC.
+
+    Args:
+        admitted: Whether messages pass through the AdmissionController or go
+            straight to an LLM limited only by the worker count
+        senders: Number of normal senders, each sending every 1-4s
+        duration: Seconds to keep sending for
+        llm_latency: Mean seconds per turn of the mock LLM pipeline
+        workers: Concurrent turns the mock LLM quota allows
+        seed: Seed for message timings and LLM latencies
+    """
+    import asyncio
+
+    import numpy as np
+
+    from agents.admission import AdmissionController
+
+    rng = np.random.default_rng(seed)
+    transport = _MockTransport()
+    quota = asyncio.Semaphore(workers)
+
+    async def generate(sender: str, text: str) -> str:
+        async with quota:
+            transport.start_turn(sender)
+            await asyncio.sleep(rng.lognormal(np.log(llm_latency), 0.5))
+        return "reply"
+
+    controller = AdmissionController(
+        generate,
+        busy_reply=lambda outcome: "busy",
+        workers=workers,
+    )
+
+    async def deliver(sender: str, text: str, sent_at: float):
+        if admitted:
+
+            async def reply(response: str):
+                if response == "busy":
+                    transport.busy(sender, sent_at)
+                else:
+                    transport.reply(sender)
+
+            await controller.submit(sender, text, reply)
+        else:
+            await generate(sender, text)
+            transport.reply(sender)
+
+    async def player(sender: str, interval: tuple[float, float]):
+        tasks = []
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            sent_at = transport.send(sender)
+            tasks.append(asyncio.create_task(deliver(sender, "hello", sent_at)))
+            await asyncio.sleep(rng.uniform(*interval))
+        await asyncio.gather(*tasks)
+
+    players = [player("chatty", (0.02, 0.1))]
+    players += [player(f"player-{index}", (1.0, 4.0)) for index in range(senders)]
+    await asyncio.gather(*players)
+    # Let admitted turns still in the queue finish
+    while admitted and (controller.pending or any(transport.outstanding.values())):
+        await asyncio.sleep(0.05)
+    await controller.close()
+    transport.stats = controller.stats
+    return transport
+
+
+def benchmark_admission(senders: int, duration: float, llm_latency: float, workers: int):
+    """Load-test admission control with a mock transport and mock LLM.
+
+    One chatty sender floods the NPC while the other senders chat normally.
+    Reports each run's message latency percentiles, the chatty sender's share
+    of LLM turns and Jain's fairness index over turns per sender, with and
+    without the admission layer.
+
+    Args:
+        senders: Number of normal senders
+        duration: Seconds each run keeps sending for
+        llm_latency: Mean seconds per turn of the mock LLM pipeline
+        workers: Concurrent turns the mock LLM quota allows
+    """
+    import asyncio
+
+    # Busy replies are logged per message, too many to read under load
+    logging.getLogger("agents.admission").setLevel(logging.WARNING)
+    for admitted in (False, True):
+        name = "admission" if admitted else "no admission"
+        transport = asyncio.run(
+            _run_load(admitted, senders, duration, llm_latency, workers, seed=0)
+        )
+        turns = [transport.turns.get(sender, 0) for sender in transport.outstanding]
+        normal = [
+            latency
+            for sender, latencies in transport.latencies.items()
+            if sender != "chatty"
+            for latency in latencies
+        ]
+        chatty = transport.latencies.get("chatty", [])
+        logger.info(
+            f"{name}: {sum(turns)} LLM turns, chatty share "
+            f"{transport.turns.get('chatty', 0) / max(1, sum(turns)):.0%}, "
+            f"Jain fairness {_jain_index(turns):.2f}"
+        )
+        logger.info(
+            f"{name}: normal senders' reply latency p50 {_percentile(normal, 50):.2f}s "
+            f"p99 {_percentile(normal, 99):.2f}s over {len(normal)} messages, "
+            f"chatty p99 {_percentile(chatty, 99):.2f}s"
+        )
+        if admitted:
+            logger.info(
+                f"{name}: {transport.stats}, busy reply p99 "
+                f"{1000 * _percentile(transport.busy_latencies, 99):.2f}ms"
+            )
+
+
+def _synthetic_sentence(rng, words: list[str], low: int, high: int) -> str:
+    """Return a sentence of between low and high random words."""
+    return " ".join(rng.choice(words, size=int(rng.integers(low, high)))).capitalize() + "."
+
+
+def _rank_memories(query: str, memories: list[str], count: int) -> list[str]:
+    """Rank memories by word overlap with the query, standing in for vector search."""
+    query_words = set(query.lower().split())
+    return sorted(
+        memories,
+        key=lambda memory: len(query_words & set(memory.lower().split())),
+        reverse=True,
+    )[:count]
+
+
+async def _run_conversations(conversations: int, turns: int) -> dict:
+    """Play synthetic conversations through the old and the budgeted prompt builders.
+
+    The old prompt is the one generate_response used to build: the indented
+    character JSON, the dialogue style and the top raw memory, where memories of
+    combat turns include the character stats block.
+
+    Returns:
+        Per-turn prompt token counts for both builders, keyed by turn number,
+        and the assembly times of the budgeted builder in seconds.
+    """
+    import asyncio
+
+    import numpy as np
+
+    from agents.context_manager import (
+        MEMORY_RESULTS,
+        SUMMARY_WORDS,
+        ContextManager,
+        character_sheet,
+        estimate_tokens,
+    )
+    from agents.template_store import TemplateStore
+
+    rng = np.random.default_rng(0)
+    words = (
+        "the a tavern ale dragon sword gold coin road king guard thief wizard spell "
+        "night forest cave map quest brother debt favour blood oath ship storm tower "
+        "rumour silver key door ghost war price you me never always tomorrow"
+    ).split()
+
+    async def summarize(summary: str, new_turns: list[str]) -> str:
+        await asyncio.sleep(0.001)
+        return " ".join((summary + " " + " ".join(new_turns)).split()[-SUMMARY_WORDS:])
+
+    store = TemplateStore()
+    context_manager = ContextManager(summarize)
+    results = {"old": {}, "budgeted": {}, "assembly": []}
+    for conversation in range(conversations):
+        sender = f"player-{conversation}"
+        template = store.template(int(rng.integers(len(store))))
+        character_json = json.dumps(template, indent=2)
+        header = f"You are NPC.\nCharacter: {character_sheet(template)}"
+        dialogue_style = [_synthetic_sentence(rng, words, 10, 40)]
+        memories = []
+        for turn in range(turns):
+            query = _synthetic_sentence(rng, words, 5, 40)
+            ranked = _rank_memories(query, memories, MEMORY_RESULTS)
+            old_prompt = (
+                f"You are NPC.\n"
+                f"Character: {character_json}\n"
+                f"Dialogue style: {dialogue_style}\n"
+                f"Past interactions: {ranked[0] if ranked else 'First encounter.'}\n"
+                f"Respond in character to the player's message."
+            )
+            start = time.perf_counter()
+            prompt = context_manager.assemble(
+                sender,
+                header,
+                "Respond in character to the player's message.",
+                ranked,
+                dialogue_style,
+            )
+            results["assembly"].append(time.perf_counter() - start)
+            results["old"].setdefault(turn, []).append(estimate_tokens(old_prompt))
+            results["budgeted"].setdefault(turn, []).append(estimate_tokens(prompt))
+            reply = _synthetic_sentence(rng, words, 20, 120)
+            # One turn in ten ends in combat, whose stats block the old code stored
+            combat = f"\n\n---\n**Character Stats:**\n\n```json\n{character_json}\n```"
+            stored_reply = reply + (combat if turn % 10 == 9 else "")
+            memories.append(f"Player: {query}\nYou: {stored_reply}")
+            context_manager.record_turn(sender, f"Player: {query}\nYou: {reply}")
+            # Let the background summary task run, as the LLM call would
+            await asyncio.sleep(0)
+    for context in context_manager.senders.values():
+        if context.summary_task is not None:
+            await context.summary_task
+    return results
+
+
+def benchmark_context(conversations: int, turns: int, prefill_ms: float, base_ms: float):
+    """Compare prompt tokens and modelled latency of the old and budgeted prompts.
+
+    Response latency is modelled as a fixed base plus a prefill cost per prompt
+    token, plus the measured time to assemble the budgeted prompt.
+
+    Args:
+        conversations: Number of synthetic conversations
+        turns: Turns per conversation
+        prefill_ms: Modelled milliseconds per prompt token
+        base_ms: Modelled milliseconds per response regardless of prompt size
+    """
+    import asyncio
+
+    import numpy as np
+
+    from agents.context_manager import PROMPT_TOKEN_BUDGET
+
+    results = asyncio.run(_run_conversations(conversations, turns))
+    assembly_ms = 1000 * float(np.mean(results["assembly"]))
+    for name in ("old", "budgeted"):
+        tokens = np.array([results[name][turn] for turn in range(turns)])
+        latency = base_ms + prefill_ms * tokens + (assembly_ms if name == "budgeted" else 0)
+        logger.info(
+            f"{name}: prompt tokens mean {tokens.mean():.0f}, p95 "
+            f"{np.percentile(tokens, 95):.0f}, max {tokens.max()} "
+            f"(turn 1 mean {tokens[0].mean():.0f}, turn {turns} mean "
+            f"{tokens[-1].mean():.0f}); modelled latency mean {latency.mean():.0f}ms, "
+            f"p95 {np.percentile(latency, 95):.0f}ms"
+        )
+    logger.info(
+        f"budgeted: {PROMPT_TOKEN_BUDGET} token budget, "
+        f"assembly {1000 * assembly_ms:.0f}us per prompt"
+    )
+
+
+def main():
+    """Parse the command line and run the selected benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    embedding_parser = subparsers.add_parser(
+        "embedding", help="CPU embedding docs/s as the worker count scales"
+    )
+    embedding_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    embedding_parser.add_argument("--limit", type=int, default=20000)
+
+    bundle_parser = subparsers.add_parser(
+        "bundle", help="index bundle load time against a full rebuild"
+    )
+    bundle_parser.add_argument("--bundle-path", type=Path, default=Path("./index_bundle"))
+    bundle_parser.add_argument("--skip-rebuild", action="store_true")
+
+    templates_parser = subparsers.add_parser(
+        "templates", help="typed template store against JSON and ChromaDB metadata"
+    )
+    templates_parser.add_argument("--repeats", type=int, default=100)
+
+    cleaning_parser = subparsers.add_parser(
+        "cleaning", help="streaming against in-memory template cleaning"
+    )
+    cleaning_parser.add_argument("--copies", type=int, default=20)
+    cleaning_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+
+    combat_parser = subparsers.add_parser(
+        "combat", help="combat turn latency and encounter simulation throughput"
+    )
+    combat_parser.add_argument("--turns", type=int, default=10000)
+    combat_parser.add_argument("--encounters", type=int, default=10000)
+    combat_parser.add_argument("--seed", type=int, default=0)
+
+    state_parser = subparsers.add_parser(
+        "state", help="state checkpoint overhead per turn and recovery time"
+    )
+    state_parser.add_argument("--sessions", type=int, default=5000)
+    state_parser.add_argument("--turns", type=int, default=20)
+
+    admission_parser = subparsers.add_parser(
+        "admission", help="admission control fairness and tail latency under load"
+    )
+    admission_parser.add_argument("--senders", type=int, default=20)
+    admission_parser.add_argument("--duration", type=float, default=20.0)
+    admission_parser.add_argument("--llm-latency", type=float, default=0.5)
+    admission_parser.add_argument("--workers", type=int, default=2)
+
+    context_parser = subparsers.add_parser(
+        "context", help="prompt tokens and latency over long synthetic conversations"
+    )
+    context_parser.add_argument("--conversations", type=int, default=10)
+    context_parser.add_argument("--turns", type=int, default=200)
+    context_parser.add_argument("--prefill-ms", type=float, default=0.5)
+    context_parser.add_argument("--base-ms", type=float, default=400.0)
+
+    args = parser.parse_args()
+    if args.benchmark == "embedding":
+        benchmark_embedding(args.workers, args.limit)
+    elif args.benchmark == "bundle":
+        benchmark_bundle(args.bundle_path, not args.skip_rebuild)
+    elif args.benchmark == "templates":
+        benchmark_templates(args.repeats)
+    elif args.benchmark == "cleaning":
+        benchmark_cleaning(args.copies, args.workers)
+    elif args.benchmark == "combat":
+        benchmark_combat(args.turns, args.encounters, args.seed)
+    elif args.benchmark == "state":
+        benchmark_state(args.sessions, args.turns)
+    elif args.benchmark == "admission":
+        benchmark_admission(args.senders, args.duration, args.llm_latency, args.workers)
+    elif args.benchmark == "context":
+        benchmark_context(args.conversations, args.turns, args.prefill_ms, args.base_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,40 @@
-"""Script for cleaning the character template metadata"""
+"""Script for cleaning the character template metadata
 
+Run from the repository root with:
+    $ uv run -m scripts.clean_metadata
+"""
+
+import argparse
 import json
 import logging
+import os
+from collections.abc import Iterable, Iterator
+from itertools import islice
+from multiprocessing import Pool
 from pathlib import Path
+
+import numpy as np
 from tqdm.auto import tqdm
 
+from agents.template_store import (
+    ATTRIBUTE_NAMES,
+    CATEGORICAL_FIELDS,
+    TEMPLATE_DTYPE,
+    TEMPLATE_TABLE_PATH,
+    TEMPLATE_TABLE_VERSION,
+    parse_attributes,
+)
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 DATA_PATH = Path(__file__).parent.parent / "data"
 TEMPLATE_DATA_PATH = DATA_PATH / "character_templates"
+RAW_TEMPLATE_PATH = TEMPLATE_DATA_PATH / "dnd_chars_unique.json"
+CLEANED_TEMPLATE_PATH = TEMPLATE_DATA_PATH / "dnd_templates_cleaned.json"
+CLEANED_TEMPLATE_NDJSON_PATH = TEMPLATE_DATA_PATH / "dnd_templates_cleaned.ndjson"
+READ_CHUNK_SIZE = 1 << 20
+CLEAN_BATCH_SIZE = 4096
 
 
 def flatten_value(value):
@@ -45,17 +70,350 @@ def flatten_value(value):
         return value_str
 
 
-def main():
+class TemplateTableBuilder:
+    """Incrementally build the typed columnar template table.
+
+    Numeric fields and ability scores are stored as integers and string fields
+    as categorical codes in a NumPy structured array, so the agent can load the
+    table in milliseconds and filter it with vectorised comparisons.
+
+    Rows, hashes and summaries are spilled to temporary files in the output
+    directory every CLEAN_BATCH_SIZE templates, so only the category values
+    (which grow with the number of distinct values, not records) stay in memory.
+    The table files are replaced only once they have been written completely;
+    call discard() to remove the temporary files if the build is abandoned.
+
+    Output files:
+        templates.npy: Structured array with one TEMPLATE_DTYPE row per template
+        strings.json: Category values per field, plus template hashes and summaries
+    """
+
+    def __init__(self, output_path: Path):
+        output_path.mkdir(parents=True, exist_ok=True)
+        self.output_path = output_path
+        self.categories = {field: {} for field in CATEGORICAL_FIELDS}
+        self.count = 0
+        self._rows = []
+        self._rows_path = output_path / "templates.rows.tmp"
+        self._hashes_path = output_path / "hashes.tmp"
+        self._summaries_path = output_path / "summaries.tmp"
+        self._rows_file = open(self._rows_path, "wb")
+        self._hashes_file = open(self._hashes_path, "w", encoding="utf-8")
+        self._summaries_file = open(self._summaries_path, "w", encoding="utf-8")
+
+    def add(self, char_summary: str, char_template: dict):
+        """Append one cleaned template to the table."""
+        codes = tuple(
+            self.categories[field].setdefault(
+                char_template[field], len(self.categories[field])
+            )
+            for field in CATEGORICAL_FIELDS
+        )
+        self._rows.append(
+            (
+                char_template["level"],
+                char_template["HP"],
+                char_template["AC"],
+                parse_attributes(char_template["attributes"]),
+                *codes,
+            )
+        )
+        self._hashes_file.write(json.dumps(char_template["hash"]) + "\n")
+        self._summaries_file.write(json.dumps(char_summary) + "\n")
+        self.count += 1
+        if len(self._rows) >= CLEAN_BATCH_SIZE:
+            self._flush_rows()
+
+    def _flush_rows(self):
+        """Append the buffered rows to the temporary rows file."""
+        np.array(self._rows, dtype=TEMPLATE_DTYPE).tofile(self._rows_file)
+        self._rows = []
+
+    def _write_json_array(self, file, path: Path):
+        """Copy a file of one JSON value per line into file as a JSON array."""
+        file.write("[")
+        with open(path, "r", encoding="utf-8") as lines:
+            for index, line in enumerate(lines):
+                file.write(f"{', ' if index else ''}{line.rstrip()}")
+        file.write("]")
+
+    def discard(self):
+        """Close and remove the temporary files, safe to call more than once."""
+        for file in (self._rows_file, self._hashes_file, self._summaries_file):
+            file.close()
+        for path in (
+            self._rows_path,
+            self._hashes_path,
+            self._summaries_path,
+            self.output_path / "templates.npy.tmp",
+            self.output_path / "strings.json.tmp",
+        ):
+            path.unlink(missing_ok=True)
+
+    def save(self):
+        """Write the table files and remove the temporary files."""
+        self._flush_rows()
+        for file in (self._rows_file, self._hashes_file, self._summaries_file):
+            file.close()
+        records = np.lib.format.open_memmap(
+            self.output_path / "templates.npy.tmp",
+            mode="w+",
+            dtype=TEMPLATE_DTYPE,
+            shape=(self.count,),
+        )
+        with open(self._rows_path, "rb") as file:
+            for start in range(0, self.count, CLEAN_BATCH_SIZE):
+                chunk = np.fromfile(file, dtype=TEMPLATE_DTYPE, count=CLEAN_BATCH_SIZE)
+                records[start : start + len(chunk)] = chunk
+        records.flush()
+        del records
+        with open(self.output_path / "strings.json.tmp", "w", encoding="utf-8") as file:
+            header = {
+                "version": TEMPLATE_TABLE_VERSION,
+                "attribute_names": ATTRIBUTE_NAMES,
+                "categories": {
+                    field: list(codes) for field, codes in self.categories.items()
+                },
+            }
+            file.write(json.dumps(header)[:-1])
+            file.write(', "hash": ')
+            self._write_json_array(file, self._hashes_path)
+            file.write(', "summary": ')
+            self._write_json_array(file, self._summaries_path)
+            file.write("}")
+        os.replace(self.output_path / "templates.npy.tmp", self.output_path / "templates.npy")
+        os.replace(self.output_path / "strings.json.tmp", self.output_path / "strings.json")
+        self.discard()
+        logger.info(f"Typed template table written to {self.output_path}")
+
+
+def build_template_table(cleaned_templates: Iterable[tuple[str, dict]], output_path: Path):
+    """Write cleaned templates as a compact, typed columnar table.
+
+    Args:
+        cleaned_templates: Pairs of character summary and cleaned template
+        output_path: Directory to write the table to
+    """
+    builder = TemplateTableBuilder(output_path)
+    try:
+        for char_summary, char_template in cleaned_templates:
+            builder.add(char_summary, char_template)
+        builder.save()
+    finally:
+        builder.discard()
+
+
+def iter_json_object_items(
+    file,
+    chunk_size: int = READ_CHUNK_SIZE,
+) -> Iterator[tuple[str, object]]:
+    """Incrementally yield the key-value pairs of a top-level JSON object.
+
+    Only one value is decoded at a time, so memory use is bounded by the largest
+    single record rather than the size of the file.
+
+    Args:
+        file: Text file positioned at the start of a JSON object
+        chunk_size: Number of characters to read at a time
+
+    Yields:
+        (key, value) tuples in file order.
+
+    Raises:
+        ValueError: If the file is not a well-formed JSON object.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, eof = "", 0, False
+
+    def fill() -> bool:
+        nonlocal buffer, position, eof
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer, position = buffer[position:] + chunk, 0
+        return not eof
+
+    def skip_whitespace():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or not fill():
+                return
+
+    def expect(*characters: str) -> str:
+        nonlocal position
+        skip_whitespace()
+        if position >= len(buffer) or buffer[position] not in characters:
+            found = buffer[position : position + 20] or "end of file"
+            raise ValueError(f"Expected one of {characters!r}, found {found!r}")
+        position += 1
+        return buffer[position - 1]
+
+    def decode():
+        nonlocal position
+        skip_whitespace()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+                # A value ending exactly at the buffer end may be a truncated number
+                if end < len(buffer) or eof:
+                    position = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+
+    expect("{")
+    skip_whitespace()
+    if buffer[position : position + 1] == "}":
+        return
+    while True:
+        key = decode()
+        expect(":")
+        yield key, decode()
+        if expect(",", "}") == "}":
+            return
+
+
+def clean_template(unclean_char_template: dict) -> dict:
+    """Flatten one raw character record into the cleaned template format.
+
+    Args:
+        unclean_char_template: A raw record from dnd_chars_unique.json
+
+    Returns:
+        The cleaned template dictionary.
+
+    Raises:
+        KeyError, IndexError, StopIteration, TypeError: If the record is missing
+            fields or has an unexpected structure.
+        ValueError: If a cleaned field has the wrong type or a number does not
+            fit the typed template table.
+    """
+    class_key = next(iter(unclean_char_template["class"]))
+    clean_char_template = {
+        "hash": unclean_char_template["hash"][0],
+        "race": unclean_char_template["race"]["race"][0],
+        "background": unclean_char_template["background"][0],
+        "class": unclean_char_template["class"][class_key]["class"][0],
+        "subclass": unclean_char_template["class"][class_key]["subclass"][0],
+        "level": unclean_char_template["level"][0],
+        "feats": flatten_value(unclean_char_template["feats"]),
+        "HP": unclean_char_template["HP"][0],
+        "AC": unclean_char_template["AC"][0],
+        "attributes": flatten_value(unclean_char_template["attributes"]),
+        "alignment": unclean_char_template["alignment"]["alignment"][0],
+        "skills": flatten_value(unclean_char_template["skills"]),
+        "weapon": next(iter(unclean_char_template["weapons"]), ""),
+    }
+    for field, value in clean_char_template.items():
+        expected = int if field in ("level", "HP", "AC") else str
+        if not isinstance(value, expected) or isinstance(value, bool):
+            raise ValueError(f"{field} should be {expected.__name__}, got {value!r}")
+    for field in ("level", "HP", "AC"):
+        _check_range(field, clean_char_template[field], TEMPLATE_DTYPE[field])
+    for score in parse_attributes(clean_char_template["attributes"]):
+        _check_range("attributes", score, TEMPLATE_DTYPE["attributes"].base)
+    return clean_char_template
+
+
+def _check_range(field: str, value: int, dtype: np.dtype):
+    """Raise ValueError if value does not fit the table column's integer dtype."""
+    limits = np.iinfo(dtype)
+    if not limits.min <= value <= limits.max:
+        raise ValueError(f"{field} {value} is outside [{limits.min}, {limits.max}]")
+
+
+def _clean_item(item: tuple[str, dict]) -> tuple[str, dict | None, str | None]:
+    """Clean one (summary, raw record) pair, returning the error instead of raising."""
+    char_summary, unclean_char_template = item
+    try:
+        return char_summary, clean_template(unclean_char_template), None
+    except (KeyError, IndexError, StopIteration, TypeError, ValueError) as e:
+        return char_summary, None, f"{type(e).__name__}: {e}"
+
+
+def iter_cleaned_templates(
+    raw_items: Iterable[tuple[str, dict]],
+    workers: int = 1,
+) -> Iterator[tuple[str, dict]]:
+    """Clean raw records in order, skipping and logging any that fail validation.
+
+    Args:
+        raw_items: Pairs of character summary and raw record
+        workers: Number of cleaning processes; 1 cleans in this process
+
+    Yields:
+        Pairs of character summary and cleaned template.
+    """
+    rejected = 0
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        raw_items = iter(raw_items)
+        while batch := list(islice(raw_items, CLEAN_BATCH_SIZE)):
+            if pool is None:
+                results = map(_clean_item, batch)
+            else:
+                results = pool.map(_clean_item, batch, chunksize=256)
+            for char_summary, clean_char_template, error in results:
+                if error is not None:
+                    rejected += 1
+                    logger.warning(f"Skipping {char_summary!r}: {error}")
+                    continue
+                yield char_summary, clean_char_template
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if rejected:
+        logger.warning(f"{rejected} templates failed validation and were skipped")
+
+
+def read_cleaned_templates(
+    path: Path = CLEANED_TEMPLATE_PATH,
+) -> Iterator[tuple[str, dict]]:
+    """Stream cleaned templates from an NDJSON or JSON file.
+
+    Args:
+        path: File to read, its format is chosen by the .ndjson or .json suffix
+
+    Yields:
+        Pairs of character summary and cleaned template.
+    """
+    logger.info(f"Reading cleaned templates from {path}")
+    with open(path, "r", encoding="utf-8") as file:
+        if path.suffix == ".ndjson":
+            for line in file:
+                if line.strip():
+                    yield next(iter(json.loads(line).items()))
+        else:
+            yield from iter_json_object_items(file)
+
+
+def main(
+    input_path: Path = RAW_TEMPLATE_PATH,
+    output_format: str = "ndjson",
+    workers: int = 1,
+    table_path: Path | None = TEMPLATE_TABLE_PATH,
+    output_path: Path | None = None,
+):
     """Clean and flatten the character template metadata from the raw JSON format.
 
-    Reads the raw unique character data with nested structures and converts it into
-    a simplified, flat format suitable for ChromaDB storage and retrieval.
+    Streams the raw unique character data with nested structures and converts it
+    into a simplified, flat format suitable for ChromaDB storage and retrieval.
+    Records are read, cleaned and written one at a time and the typed table is
+    spilled to disk in batches, so memory use grows only with the number of
+    distinct category values, not with the number of records.
 
     The cleaning process:
-    1. Loads raw character templates from dnd_chars_unique.json
+    1. Streams raw character templates from dnd_chars_unique.json
     2. Extracts and flattens nested character attributes (race, class, level, etc.)
     3. Converts complex nested dictionaries into simple key-value pairs
-    4. Saves the cleaned data to dnd_templates_cleaned.json
+    4. Validates each cleaned template, logging and skipping bad records
+    5. Writes the cleaned data as NDJSON (one {summary: template} object per line)
+       or as a compact JSON object, replacing the output file only on success
+    6. Saves a typed columnar copy of the cleaned data for the agent
 
     Character attributes cleaned:
         - hash: Unique identifier
@@ -65,42 +423,84 @@ def main():
         - alignment: Character alignment
         - weapon: Primary weapon (first from weapons list)
 
+    Args:
+        input_path: Raw character data to clean
+        output_format: "ndjson" or "json"
+        workers: Number of cleaning processes
+        table_path: Directory for the typed table, or None to skip it
+        output_path: Cleaned output file, defaults to dnd_templates_cleaned.<format>
+
     Input file: data/character_templates/dnd_chars_unique.json
-    Output file: data/character_templates/dnd_templates_cleaned.json
+    Output files:
+        data/character_templates/dnd_templates_cleaned.ndjson (or .json)
+        data/character_templates/dnd_templates_table/ (see TemplateTableBuilder)
     """
-    with open(
-        TEMPLATE_DATA_PATH / "dnd_chars_unique.json",
-        "r",
-        encoding="utf-8",
-    ) as file:
-        uncleaned_template_data = json.load(file)
-    cleaned_template_data = {}
-    for char_summary, unclean_char_template in tqdm(uncleaned_template_data.items()):
-        class_key = next(iter(unclean_char_template["class"]))
-        clean_char_template = {
-            "hash": unclean_char_template["hash"][0],
-            "race": unclean_char_template["race"]["race"][0],
-            "background": unclean_char_template["background"][0],
-            "class": unclean_char_template["class"][class_key]["class"][0],
-            "subclass": unclean_char_template["class"][class_key]["subclass"][0],
-            "level": unclean_char_template["level"][0],
-            "feats": flatten_value(unclean_char_template["feats"]),
-            "HP": unclean_char_template["HP"][0],
-            "AC": unclean_char_template["AC"][0],
-            "attributes": flatten_value(unclean_char_template["attributes"]),
-            "alignment": unclean_char_template["alignment"]["alignment"][0],
-            "skills": flatten_value(unclean_char_template["skills"]),
-            "weapon": next(iter(unclean_char_template["weapons"]), ""),
-        }
-        cleaned_template_data[char_summary] = clean_char_template
-    with open(
-        TEMPLATE_DATA_PATH / "dnd_templates_cleaned.json",
-        "w",
-        encoding="utf-8",
-    ) as file:
-        json.dump(cleaned_template_data, file, indent=2)
-    logger.info("Character templates cleaned!")
+    if output_path is None:
+        output_path = (
+            CLEANED_TEMPLATE_NDJSON_PATH
+            if output_format == "ndjson"
+            else CLEANED_TEMPLATE_PATH
+        )
+    # Written next to the output and only moved into place once complete, so a
+    # failed run never leaves a truncated cleaned file behind
+    temporary_path = output_path.with_name(f"{output_path.name}.tmp")
+    builder = TemplateTableBuilder(table_path) if table_path is not None else None
+    try:
+        with (
+            open(input_path, "r", encoding="utf-8") as input_file,
+            open(temporary_path, "w", encoding="utf-8") as output_file,
+        ):
+            if output_format == "json":
+                output_file.write("{")
+            raw_items = tqdm(iter_json_object_items(input_file))
+            for count, (char_summary, clean_char_template) in enumerate(
+                iter_cleaned_templates(raw_items, workers)
+            ):
+                if output_format == "ndjson":
+                    output_file.write(json.dumps({char_summary: clean_char_template}))
+                    output_file.write("\n")
+                else:
+                    output_file.write(
+                        f"{', ' if count else ''}{json.dumps(char_summary)}: "
+                    )
+                    output_file.write(json.dumps(clean_char_template))
+                if builder is not None:
+                    builder.add(char_summary, clean_char_template)
+            if output_format == "json":
+                output_file.write("}")
+        if builder is not None:
+            builder.save()
+        os.replace(temporary_path, output_path)
+    finally:
+        temporary_path.unlink(missing_ok=True)
+        if builder is not None:
+            builder.discard()
+    logger.info(f"Character templates cleaned to {output_path}!")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--table-only",
+        action="store_true",
+        help="only rebuild the typed table from the cleaned templates",
+    )
+    parser.add_argument("--input", type=Path, default=RAW_TEMPLATE_PATH)
+    parser.add_argument(
+        "--templates",
+        type=Path,
+        default=CLEANED_TEMPLATE_PATH,
+        help="cleaned template file to rebuild the table from with --table-only",
+    )
+    parser.add_argument("--format", choices=("ndjson", "json"), default="ndjson")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes to clean records with",
+    )
+    args = parser.parse_args()
+    if args.table_only:
+        build_template_table(read_cleaned_templates(args.templates), TEMPLATE_TABLE_PATH)
+    else:
+        main(args.input, args.format, args.workers)
@@ -1,19 +1,34 @@
 """Load and process dialogue data"""
 
+import argparse
 import json
 import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import numpy as np
 import torch
 import chromadb
 from chromadb.errors import NotFoundError
 from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
 from tqdm.auto import tqdm
 
+from agents.index_bundle import (
+    EMBEDDING_MODEL_NAME,
+    INDEX_BUNDLE_PATH,
+    export_index_bundle,
+)
+from scripts.clean_metadata import CLEANED_TEMPLATE_PATH, read_cleaned_templates
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 DIALOGUE_DOC_BATCH_SIZE = 5000
+EMBEDDING_DIM = 384
+CPU_EMBEDDING_CHUNK_SIZE = 1024
+CPU_EMBEDDING_BATCH_SIZE = 64
 DATA_PATH = Path(__file__).parent.parent / "data"
 DIALOGUE_DATA_PATH = DATA_PATH / "dialogue_data"
 TEMPLATE_DATA_PATH = DATA_PATH / "character_templates"
@@ -26,8 +41,161 @@ elif torch.backends.mps.is_available():
 else:
     DEVICE = "cpu"
 
+# Per-process embedding model, created once by _init_embedding_worker
+_worker_model = None
+
+
+def _init_embedding_worker(num_threads: int):
+    """Load one CPU embedding model per worker process.
+
+    Limits the intra-op thread pool so that the workers together use each core
+    once instead of every worker spawning a thread per core.
+
+    Args:
+        num_threads: Number of intra-op threads this worker may use
+    """
+    global _worker_model
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(num_threads)
+    _worker_model = SentenceTransformer(EMBEDDING_MODEL_NAME, device="cpu")
+
+
+def _embed_chunk(texts: list[str]) -> np.ndarray:
+    """Embed a chunk of texts with the worker's model.
+
+    Args:
+        texts: Texts to embed, ideally of similar length
+
+    Returns:
+        A float32 array of shape (len(texts), embedding_dim).
+    """
+    with torch.inference_mode():
+        return _worker_model.encode(
+            texts,
+            batch_size=CPU_EMBEDDING_BATCH_SIZE,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        ).astype(np.float32)
+
+
+def embed_documents(documents: list[str], num_workers: int) -> np.ndarray:
+    """Embed documents on the CPU across a pool of worker processes.
+
+    Documents are sorted by length before being split into chunks so that each
+    batch pads to a similar sequence length, then the embeddings are returned
+    in the original document order.
+
+    Args:
+        documents: The documents to embed
+        num_workers: Number of worker processes, each with its own model
+
+    Returns:
+        A float32 array of shape (len(documents), embedding_dim).
+    """
+    if not documents:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    num_workers = max(1, num_workers)
+    threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+    order = sorted(range(len(documents)), key=lambda i: len(documents[i]))
+    sorted_documents = [documents[i] for i in order]
+    chunks = [
+        sorted_documents[start : start + CPU_EMBEDDING_CHUNK_SIZE]
+        for start in range(0, len(sorted_documents), CPU_EMBEDDING_CHUNK_SIZE)
+    ]
+    # Spawn rather than fork: the parent already runs torch and ChromaDB threads
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_embedding_worker,
+        initargs=(threads_per_worker,),
+    ) as pool:
+        sorted_embeddings = np.concatenate(
+            list(tqdm(pool.map(_embed_chunk, chunks), total=len(chunks)))
+        )
+    embeddings = np.empty_like(sorted_embeddings)
+    embeddings[order] = sorted_embeddings
+    return embeddings
+
+
+def load_dialogue_documents() -> list[str]:
+    """Extract player character utterances from the CRD3 dialogue files.
+
+    Returns:
+        A list of utterances, one per turn, excluding turns spoken only by the DM.
+    """
+    dialogue_docs = []
+    for json_file in tqdm(list(DIALOGUE_DATA_PATH.rglob("*.json"))):
+        with open(json_file, "r", encoding="utf-8") as file:
+            dialogue_data = json.load(file)
+        for chunk in dialogue_data:
+            for turn in chunk["TURNS"]:
+                # Skip if Matt Mercer is the only speaker
+                if turn["NAMES"] == "MATT":
+                    continue
+                dialogue_docs.append("".join(turn["UTTERANCES"]))
+    return dialogue_docs
+
+
+def _add_in_batches(
+    collection,
+    documents: list[str],
+    ids: list[str],
+    embeddings: np.ndarray | None = None,
+    metadatas: list[dict] | None = None,
+):
+    """Add documents to a collection in batches of DIALOGUE_DOC_BATCH_SIZE.
 
-def main():
+    Args:
+        collection: The ChromaDB collection to add to
+        documents: The documents to add
+        ids: One unique id per document
+        embeddings: Optional precomputed embeddings, one row per document
+        metadatas: Optional metadata, one dict per document
+    """
+    for start in range(0, len(documents), DIALOGUE_DOC_BATCH_SIZE):
+        end = start + DIALOGUE_DOC_BATCH_SIZE
+        collection.add(
+            documents=documents[start:end],
+            ids=ids[start:end],
+            embeddings=embeddings[start:end] if embeddings is not None else None,
+            metadatas=metadatas[start:end] if metadatas is not None else None,
+        )
+
+
+def _compute_embeddings(
+    documents: list[str],
+    embedding_function,
+    num_workers: int,
+) -> np.ndarray:
+    """Embed documents on the GPU if an embedding function is given, else on the CPU pool.
+
+    Args:
+        documents: The documents to embed
+        embedding_function: GPU embedding function, or None to use the CPU pool
+        num_workers: Number of CPU embedding processes
+
+    Returns:
+        A float32 array of shape (len(documents), embedding_dim).
+    """
+    if embedding_function is None:
+        logger.info(f"Embedding {len(documents)} docs on CPU with {num_workers} workers")
+        return embed_documents(documents, num_workers)
+    if not documents:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    batches = []
+    for start in tqdm(range(0, len(documents), DIALOGUE_DOC_BATCH_SIZE)):
+        batch = documents[start : start + DIALOGUE_DOC_BATCH_SIZE]
+        batches.append(np.asarray(embedding_function(batch), dtype=np.float32))
+    return np.concatenate(batches)
+
+
+def main(
+    num_workers: int,
+    db_path: str = "./chromadb",
+    bundle_path: Path | None = INDEX_BUNDLE_PATH,
+    template_path: Path = CLEANED_TEMPLATE_PATH,
+):
     """Process and load D&D dialogue and character template data into ChromaDB.
 
     This function performs the following operations:
@@ -35,7 +203,9 @@ def main():
     2. Loads dialogue data from JSON files in the dialogue_data directory
     3. Extracts character utterances (excluding DM dialogue) and stores them
     4. Loads character templates from cleaned template data
-    5. Uses GPU acceleration for embeddings if available (CUDA or MPS)
+    5. Uses GPU acceleration for embeddings if available (CUDA or MPS), otherwise
+       precomputes embeddings across a pool of CPU worker processes
+    6. Optionally exports both collections as a portable index bundle
 
     The function processes:
         - Dialogue data: Character speech from Critical Role episodes
@@ -45,13 +215,20 @@ def main():
         - character_dialogue: Stores individual character utterances for dialogue style retrieval
         - character_templates: Stores character stat blocks with searchable summaries
 
+    Args:
+        num_workers: Number of CPU embedding processes, only used without a GPU
+        db_path: Directory of the persistent ChromaDB client
+        bundle_path: Directory to export the index bundle to, or None to skip it
+        template_path: Cleaned character template file, NDJSON or JSON
+
     Side Effects:
         - Deletes existing collections if they exist
         - Creates new ChromaDB collections
-        - Writes embeddings to ./chromadb directory
+        - Writes embeddings to the db_path directory
+        - Replaces the index bundle at bundle_path
     """
     db = chromadb.PersistentClient(
-        path="./chromadb",
+        path=db_path,
     )
     try:
         db.delete_collection("character_dialogue")
@@ -65,41 +242,29 @@ def main():
         pass
     if DEVICE in ["cuda", "mps"]:
         embedding_function = SentenceTransformerEmbeddingFunction(
-            model_name="all-MiniLM-L6-v2",
+            model_name=EMBEDDING_MODEL_NAME,
             device=DEVICE,
         )
     else:
         embedding_function = None
+    collection_metadata = {"hnsw:space": "cosine"}
     # Create and populate dialogue collection
     dialogue_collection = db.create_collection(
         name="character_dialogue",
         embedding_function=embedding_function,
-        metadata={"hnsw:space": "cosine"},
+        metadata=collection_metadata,
+    )
+    dialogue_docs = load_dialogue_documents()
+    dialogue_ids = [f"{counter}" for counter in range(len(dialogue_docs))]
+    dialogue_embeddings = _compute_embeddings(
+        dialogue_docs, embedding_function, num_workers
+    )
+    _add_in_batches(
+        dialogue_collection,
+        dialogue_docs,
+        dialogue_ids,
+        embeddings=dialogue_embeddings,
     )
-    counter = 0
-    dialogue_docs, dialogue_ids = [], []
-    for json_file in tqdm(list(DIALOGUE_DATA_PATH.rglob("*.json"))):
-        with open(json_file, "r", encoding="utf-8") as file:
-            dialogue_data = json.load(file)
-        for chunk in dialogue_data:
-            for turn in chunk["TURNS"]:
-                # Skip if Matt Mercer is the only speaker
-                if turn["NAMES"] == "MATT":
-                    continue
-                dialogue_docs.append("".join(turn["UTTERANCES"]))
-                dialogue_ids.append(f"{counter}")
-                counter += 1
-                if len(dialogue_docs) % DIALOGUE_DOC_BATCH_SIZE == 0:
-                    dialogue_collection.add(
-                        documents=dialogue_docs,
-                        ids=dialogue_ids,
-                    )
-                    dialogue_docs, dialogue_ids = [], []
-    if dialogue_docs:
-        dialogue_collection.add(
-            documents=dialogue_docs,
-            ids=dialogue_ids,
-        )
 
     logger.info("JSON dialogue extraction complete")
 
@@ -107,25 +272,84 @@ def main():
     template_collection = db.create_collection(
         name="character_templates",
         embedding_function=embedding_function,
-        metadata={"hnsw:space": "cosine"},
+        metadata=collection_metadata,
+    )
+    template_data = dict(read_cleaned_templates(template_path))
+
+    template_docs = list(template_data.keys())
+    template_ids = [char_template["hash"] for char_template in template_data.values()]
+    template_metadatas = list(template_data.values())
+    template_embeddings = _compute_embeddings(
+        template_docs, embedding_function, num_workers
+    )
+    _add_in_batches(
+        template_collection,
+        template_docs,
+        template_ids,
+        embeddings=template_embeddings,
+        metadatas=template_metadatas,
     )
-    with open(
-        TEMPLATE_DATA_PATH / "dnd_templates_cleaned.json",
-        "r",
-        encoding="utf-8",
-    ) as file:
-        template_data = json.load(file)
-
-    for char_summary, char_template in template_data.items():
-        template_collection.add(
-            documents=[char_summary],
-            metadatas=[char_template],
-            ids=[char_template["hash"]],
-        )
 
     logger.info("JSON unique character template extraction complete")
 
+    if bundle_path is not None:
+        export_index_bundle(
+            bundle_path,
+            {
+                "character_dialogue": {
+                    "documents": dialogue_docs,
+                    "ids": dialogue_ids,
+                    "embeddings": dialogue_embeddings,
+                    "metadatas": None,
+                    "metadata": collection_metadata,
+                },
+                "character_templates": {
+                    "documents": template_docs,
+                    "ids": template_ids,
+                    "embeddings": template_embeddings,
+                    "metadatas": template_metadatas,
+                    "metadata": collection_metadata,
+                },
+            },
+            {
+                "dialogue_data": ("dialogue_data", "**/*.json"),
+                "character_templates": (
+                    os.path.relpath(template_path.resolve().parent, DATA_PATH.resolve()),
+                    template_path.name,
+                ),
+            },
+        )
+
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of CPU embedding processes (ignored when a GPU is available)",
+    )
+    parser.add_argument(
+        "--bundle-path",
+        type=Path,
+        default=INDEX_BUNDLE_PATH,
+        help="directory to export the portable index bundle to",
+    )
+    parser.add_argument(
+        "--templates",
+        type=Path,
+        default=CLEANED_TEMPLATE_PATH,
+        help="cleaned character template file (.ndjson or .json) to load",
+    )
+    parser.add_argument(
+        "--no-bundle",
+        action="store_true",
+        help="skip exporting the index bundle",
+    )
+    args = parser.parse_args()
+    main(
+        args.workers,
+        bundle_path=None if args.no_bundle else args.bundle_path,
+        template_path=args.templates,
+    )
     print("Processing complete!")